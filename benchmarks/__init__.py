@@ -0,0 +1,13 @@
+"""
+Benchmarks for delugram's hot paths, run against fake deluge components instead of a live daemon.
+
+    python -m benchmarks --sizes 1000,10000,100000 --chats 100 > results.json
+
+Results are printed as JSON, one entry per benchmark and library size.
+"""
+
+import builtins
+
+# deluge installs this while starting up, the benchmarks don't start deluge
+if not hasattr(builtins, '_'):
+    builtins._ = lambda text: text
@@ -0,0 +1,164 @@
+"""
+Runs the benchmarks and prints the results as JSON.
+
+Core is enabled against the fakes in benchmarks.fakes. Calls it would normally hand to the reactor
+thread are made directly, so the timings are delugram's own work, without deluge or telegram.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeDeluge
+from delugram.core import INFOS, PAGE_SIZE, STATUS_STATES
+
+LOOKUPS = 10000
+BURST = 1000
+
+
+def measure(func, repeat, number=1):
+    """Runs func number times per round, for repeat rounds. Returns seconds per call of each round."""
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number)
+    return rounds
+
+
+def result(name, torrents, chats, rounds, **extra):
+    return {
+        'benchmark': name,
+        'torrents': torrents,
+        'chats': chats,
+        'rounds': len(rounds),
+        'min_s': min(rounds),
+        'median_s': statistics.median(rounds),
+        'mean_s': statistics.mean(rounds),
+        **extra,
+    }
+
+
+async def run_direct(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def run_size(torrents, chats, repeat):
+    rng = random.Random(torrents)
+    results = []
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        fakes = FakeDeluge(torrents, chats)
+        # start from the old config format, so enabling includes the migration into the ownership store
+        started = time.perf_counter()
+        core = fakes.enable_core(config_dir, chat_torrents=fakes.chat_torrents())
+        elapsed = time.perf_counter() - started
+        # there is no reactor thread to hand calls to
+        core.run_in_reactor = run_direct
+        results.append(result('enable', torrents, chats, [elapsed]))
+
+        loop = asyncio.new_event_loop()
+        try:
+            torrent_ids = list(fakes.torrent_manager.torrents)
+            largest_chat = fakes.chat_ids[0]
+
+            ids = [rng.choice(torrent_ids) for _ in range(LOOKUPS)]
+            results.append(result('get_torrent_chat', torrents, chats, measure(
+                lambda: [core.get_torrent_chat(torrent_id) for torrent_id in ids], repeat
+            ), ops=LOOKUPS))
+
+            candidates = [rng.choice(fakes.chat_ids) if i % 2 else str(rng.randint(1, 10 ** 9)) for i in range(LOOKUPS)]
+            results.append(result('chat_is_permitted', torrents, chats, measure(
+                lambda: [core.chat_is_permitted(chat_id) for chat_id in candidates], repeat
+            ), ops=LOOKUPS))
+
+            page = rng.sample(torrent_ids, min(PAGE_SIZE, len(torrent_ids)))
+            statuses = fakes.core.get_torrents_status({'id': page}, INFOS)
+            names = core.store.names(page)
+            results.append(result('format_torrent_info', torrents, chats, measure(
+                lambda: [core.format_torrent_info(dict(statuses[torrent_id]), names.get(torrent_id, None))
+                         for torrent_id in page],
+                repeat
+            ), ops=len(page)))
+
+            def list_cold():
+                core.status_pages.clear()
+                loop.run_until_complete(core.list_torrents(largest_chat, STATUS_STATES, 1))
+
+            results.append(result('list_torrents', torrents, chats, measure(list_cold, repeat),
+                                  chat_torrents=len(core.store.chat_torrents(largest_chat))))
+            results.append(result('list_torrents_cached', torrents, chats, measure(
+                lambda: loop.run_until_complete(core.list_torrents(largest_chat, STATUS_STATES, 1)), repeat
+            )))
+
+            results.append(result('cleanup_chat_torrents', torrents, chats,
+                                  measure(core.cleanup_chat_torrents, repeat)))
+
+            def added_burst():
+                for _ in range(BURST):
+                    fakes.event_manager.fire('TorrentAddedEvent', fakes.add_torrent(), False)
+
+            results.append(result('torrent_added_burst', torrents, chats, measure(added_burst, repeat), ops=BURST))
+
+            def state_changed_burst():
+                for torrent_id in rng.sample(torrent_ids, min(BURST, len(torrent_ids))):
+                    fakes.event_manager.fire('TorrentStateChangedEvent', torrent_id, 'Seeding')
+
+            results.append(result('torrent_state_changed_burst', torrents, chats,
+                                  measure(state_changed_burst, repeat), ops=BURST))
+
+            def removed_burst():
+                for torrent_id in list(fakes.torrent_manager.torrents)[:BURST]:
+                    del fakes.torrent_manager.torrents[torrent_id]
+                    fakes.event_manager.fire('TorrentRemovedEvent', torrent_id)
+                core.process_pending_removals()
+                core.store.flush()
+
+            results.append(result('torrent_removed_burst', torrents, chats, measure(removed_burst, repeat), ops=BURST))
+        finally:
+            loop.close()
+            core.store.close()
+            fakes.shutdown()
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="comma separated numbers of torrents to benchmark with (default: %(default)s)")
+    parser.add_argument('--chats', type=int, default=100, help="number of registered chats (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="rounds per benchmark (default: %(default)s)")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    # notifications have no bot to go to, keep the resulting errors out of the way
+    logging.getLogger('delugram').setLevel(logging.CRITICAL)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for size in (int(size) for size in args.sizes.split(',')):
+        report['results'].extend(run_size(size, args.chats, args.repeat))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+A local stand-in for the Telegram Bot API, for load testing the bot without telegram.
+
+It serves the methods delugram uses (getUpdates, sendMessage, editMessageText, getFile, file downloads
+and a few housekeeping calls) on top of delugram's own HttpListener. Simulated chats follow a script:
+each step is a message the chat sends and a piece of text the bot's reply has to contain, and the next
+step is only sent once that reply arrived. The time between handing an update out through getUpdates
+and the expected reply arriving is recorded per step.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import defaultdict, deque
+from http import HTTPStatus
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from delugram.httpserver import HttpListener
+
+# parameters telegram sends json encoded in form data, everything else is a plain string
+JSON_PARAMETERS = {'chat_id', 'message_id', 'offset', 'limit', 'timeout', 'reply_markup', 'allowed_updates'}
+
+
+class Step(NamedTuple):
+    name: str
+    text: str
+    expect: str
+    # sent as a .torrent document (with text as its file name) when set
+    document: Optional[bytes] = None
+
+
+class ChatScript(object):
+    def __init__(self, chat_id, steps: List[Step]):
+        self.chat_id = chat_id
+        self.steps = steps
+        self.position = 0
+        self.sent_at: Optional[float] = None
+
+    @property
+    def step(self) -> Optional[Step]:
+        return self.steps[self.position] if self.position < len(self.steps) else None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class FakeBotApi(object):
+    def __init__(self, token, scripts: List[ChatScript], host='127.0.0.1', port=0):
+        self.token = token
+        self.scripts: Dict[int, ChatScript] = {script.chat_id: script for script in scripts}
+        self.listener = HttpListener(host, port, self.handle, name='fake Bot API')
+        self.files: Dict[str, bytes] = {}
+
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self.new_updates: Optional[asyncio.Event] = None
+        self.finished: Optional[asyncio.Event] = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.messages = 0
+        self.started: Optional[float] = None
+        self.completed = 0
+
+    @property
+    def url(self):
+        host, port = self.listener.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self):
+        self.new_updates = asyncio.Event()
+        self.finished = asyncio.Event()
+        await self.listener.start()
+
+    async def stop(self):
+        await self.listener.stop()
+
+    def begin(self):
+        """Sends the first step of every script"""
+        self.started = time.perf_counter()
+        for script in self.scripts.values():
+            self._send_step(script)
+
+    def _send_step(self, script: ChatScript):
+        step = script.step
+        if step is None:
+            self.completed += 1
+            if self.completed == len(self.scripts):
+                self.finished.set()
+            return
+
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': script.chat_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': script.chat_id, 'is_bot': False, 'first_name': 'Load'},
+        }
+        if step.document is not None:
+            file_id = f"document{message['message_id']}"
+            self.files[file_id] = step.document
+            message['document'] = {'file_id': file_id, 'file_unique_id': file_id, 'file_name': step.text,
+                                   'mime_type': 'application/x-bittorrent', 'file_size': len(step.document)}
+        else:
+            message['text'] = step.text
+        if step.document is None and step.text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(step.text.split()[0])}]
+
+        script.sent_at = None
+        self.updates.append({'update_id': next(self._update_ids), 'message': message, '_script': script})
+        self.new_updates.set()
+
+    def _received(self, chat_id, text):
+        self.messages += 1
+        script = self.scripts.get(chat_id, None)
+        if script is None or script.step is None or script.sent_at is None:
+            return
+        if script.step.expect not in text:
+            return
+
+        self.latencies[script.step.name].append(time.perf_counter() - script.sent_at)
+        script.position += 1
+        self._send_step(script)
+
+    async def handle(self, method, path, headers, body):
+        path = unquote(urlsplit(path).path)
+        if path.startswith(f"/file/bot{self.token}/"):
+            content = self.files.get(path[len(f"/file/bot{self.token}/"):], None)
+            if content is None:
+                return HTTPStatus.NOT_FOUND, 'text/plain', b''
+            return HTTPStatus.OK, 'application/octet-stream', content
+
+        prefix = f"/bot{self.token}/"
+        if not path.startswith(prefix):
+            return HTTPStatus.NOT_FOUND, 'application/json', self._error(404, "Not Found")
+
+        api_method = path[len(prefix):]
+        self.calls[api_method] += 1
+        params = self._parse(headers, body)
+        handler = getattr(self, f"api_{api_method}", None)
+        result = await handler(params) if handler else True
+        return HTTPStatus.OK, 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+    @staticmethod
+    def _parse(headers, body):
+        if not body:
+            return {}
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body)
+
+        params = {}
+        for key, value in parse_qsl(body.decode('utf-8'), keep_blank_values=True):
+            params[key] = json.loads(value) if key in JSON_PARAMETERS else value
+        return params
+
+    @staticmethod
+    def _error(code, description):
+        return json.dumps({'ok': False, 'error_code': code, 'description': description}).encode()
+
+    async def api_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+
+    async def api_getUpdates(self, params):
+        offset = params.get('offset', 0) or 0
+        while len(self.updates) and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+
+        if not len(self.updates):
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), params.get('timeout', 0) or 0)
+            except asyncio.TimeoutError:
+                pass
+
+        updates = list(itertools.islice(self.updates, params.get('limit', 100) or 100))
+        now = time.perf_counter()
+        for update in updates:
+            # latency is measured from the moment the bot got the update
+            if update['_script'].sent_at is None:
+                update['_script'].sent_at = now
+        return [{k: v for k, v in update.items() if k != '_script'} for update in updates]
+
+    async def api_sendMessage(self, params):
+        self._received(params['chat_id'], params.get('text', ''))
+        return self._message(params)
+
+    async def api_editMessageText(self, params):
+        self._received(params['chat_id'], params.get('text', ''))
+        return self._message(params, params.get('message_id', None))
+
+    async def api_getFile(self, params):
+        file_id = params.get('file_id', '')
+        return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self.files.get(file_id, b'')),
+                'file_path': file_id}
+
+    def _message(self, params, message_id=None):
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': params['chat_id'], 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Fake'},
+            'text': params.get('text', ''),
+        }
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return {
+            'chats': len(self.scripts),
+            'completed_chats': self.completed,
+            'elapsed_s': elapsed,
+            'messages': self.messages,
+            'messages_per_s': self.messages / elapsed if elapsed else 0,
+            'cycles_per_s': self.completed / elapsed if elapsed else 0,
+            'calls': dict(self.calls),
+            'steps': {
+                name: {
+                    'count': len(values),
+                    'p50_ms': percentile(values, 0.5) * 1000,
+                    'p99_ms': percentile(values, 0.99) * 1000,
+                    'mean_ms': statistics.mean(values) * 1000,
+                } for name, values in self.latencies.items()
+            },
+        }
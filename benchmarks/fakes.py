@@ -0,0 +1,210 @@
+"""
+Stand-ins for the deluge components delugram's Core talks to, holding synthetic torrents in memory.
+
+They implement just enough of TorrentManager, Core, EventManager, RPCServer and ConfigManager for
+Core.enable() and the code paths under benchmark. Everything runs synchronously on the calling thread.
+"""
+from __future__ import unicode_literals
+
+import random
+import time
+from base64 import b64encode
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+from unittest import mock
+
+import deluge.configmanager
+from deluge import component
+from deluge.bencode import bencode
+
+import delugram.core
+from delugram.core import Core, DEFAULT_PREFS
+
+# info dict of a single file torrent, the smallest deluge accepts
+TORRENT_METADATA = {b'name': b'fake', b'piece length': 16384, b'pieces': b'0' * 20, b'length': 1}
+
+STATES = ('Downloading', 'Seeding', 'Paused', 'Queued', 'Checking', 'Error')
+# rough mix of a long running daemon: mostly seeding, some downloading
+STATE_WEIGHTS = (15, 60, 15, 5, 3, 2)
+
+
+class FakeTorrent(object):
+    def __init__(self, torrent_id, name, chat_id, rng: random.Random):
+        self.torrent_id = torrent_id
+        self.options: Dict[str, Any] = {'delugram_chat_id': chat_id, 'file_priorities': [4]}
+        state = rng.choices(STATES, STATE_WEIGHTS)[0]
+        self.status: Dict[str, Any] = {
+            'queue': rng.randint(-1, 500),
+            'state': state,
+            'name': name,
+            'total_wanted': rng.randint(1, 50) * 1024 ** 3,
+            'progress': 100.0 if state == 'Seeding' else rng.uniform(0, 100),
+            'num_seeds': rng.randint(0, 50),
+            'num_peers': rng.randint(0, 50),
+            'total_seeds': rng.randint(0, 500),
+            'total_peers': rng.randint(0, 500),
+            'download_payload_rate': rng.randint(0, 10 * 1024 ** 2),
+            'upload_payload_rate': rng.randint(0, 1024 ** 2),
+            'eta': rng.randint(0, 86400),
+            'time_added': time.time() - rng.randint(0, 365 * 86400),
+        }
+
+    def get_status(self, keys):
+        return {key: self.status[key] for key in keys if key in self.status}
+
+
+class FakeTorrentManager(component.Component):
+    def __init__(self, fakes: 'FakeDeluge'):
+        super().__init__('TorrentManager')
+        self.fakes = fakes
+        self.torrents: Dict[str, FakeTorrent] = {}
+
+    def __getitem__(self, torrent_id):
+        return self.torrents[torrent_id]
+
+    def __contains__(self, torrent_id):
+        return torrent_id in self.torrents
+
+    def get_torrent_list(self):
+        return list(self.torrents)
+
+    def add(self, torrent_info=None, state=None, options=None, save_state=True, filedump=None, filename=None,
+            magnet=None, resume_data=None):
+        torrent_id = self.fakes.add_torrent((options or {}).get('delugram_chat_id', None))
+        self.fakes.event_manager.fire('TorrentAddedEvent', torrent_id, False)
+        return torrent_id
+
+    def save_state(self):
+        pass
+
+
+class FakeCore(component.Component):
+    def __init__(self, fakes: 'FakeDeluge'):
+        super().__init__('Core')
+        self.fakes = fakes
+
+    def get_torrents_status(self, filter_dict, keys, diff=False):
+        torrents = self.fakes.torrent_manager.torrents
+        ids = filter_dict.get('id', list(torrents)) if filter_dict else list(torrents)
+        return {torrent_id: torrents[torrent_id].get_status(keys) for torrent_id in ids if torrent_id in torrents}
+
+    def prefetch_magnet_metadata(self, magnet, timeout=30):
+        return '%040x' % random.getrandbits(160), b64encode(bencode(TORRENT_METADATA))
+
+    def add_torrent_magnet(self, uri, options):
+        return self.fakes.torrent_manager.add(options=options, magnet=uri)
+
+
+class FakeEventManager(component.Component):
+    def __init__(self):
+        super().__init__('EventManager')
+        self.handlers: Dict[str, List[Callable]] = defaultdict(list)
+
+    def register_event_handler(self, event, handler):
+        self.handlers[event].append(handler)
+
+    def deregister_event_handler(self, event, handler):
+        if handler in self.handlers[event]:
+            self.handlers[event].remove(handler)
+
+    def fire(self, event, *args):
+        """Calls the handlers of event directly, like deluge's EventManager does on the reactor thread"""
+        for handler in self.handlers[event]:
+            handler(*args)
+
+    def emit(self, event):
+        pass
+
+
+class FakeRPCServer(component.Component):
+    def __init__(self):
+        super().__init__('RPCServer')
+
+    def register_object(self, obj, name=None):
+        pass
+
+    def deregister_object(self, obj):
+        pass
+
+
+class FakeConfig(object):
+    """In-memory replacement for deluge.config.Config, saving is a no-op"""
+
+    def __init__(self, filename, defaults=None):
+        self.filename = filename
+        self.config: Dict[str, Any] = dict(defaults or {})
+        self.saves = 0
+
+    def __getitem__(self, key):
+        return self.config[key]
+
+    def __setitem__(self, key, value):
+        self.config[key] = value
+
+    def __delitem__(self, key):
+        del self.config[key]
+
+    def __contains__(self, key):
+        return key in self.config
+
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+
+    def save(self):
+        self.saves += 1
+        return True
+
+
+class FakeDeluge(object):
+    """
+    Registers the fake components and fills them with `torrents` synthetic torrents spread over
+    `chats` registered chats (with a power law, a few chats own most of the library).
+    """
+
+    def __init__(self, torrents, chats, seed=42):
+        self.rng = random.Random(seed)
+        self.torrent_manager = FakeTorrentManager(self)
+        self.event_manager = FakeEventManager()
+        self.core = FakeCore(self)
+        self.rpc_server = FakeRPCServer()
+        self.chat_ids = [str(100000 + i) for i in range(chats)]
+        self.weights = [1 / (i + 1) for i in range(chats)]
+        self._next_id = 0
+
+        for _ in range(torrents):
+            self.add_torrent()
+
+    def add_torrent(self, chat_id=None):
+        torrent_id = '%040x' % self._next_id
+        self._next_id += 1
+        chat_id = str(chat_id or self.rng.choices(self.chat_ids, self.weights)[0])
+        self.torrent_manager.torrents[torrent_id] = FakeTorrent(torrent_id, f"Torrent {torrent_id[-8:]}",
+                                                                chat_id, self.rng)
+        return torrent_id
+
+    def chat_torrents(self):
+        """The chat_torrents map older delugram versions kept in delugram.conf"""
+        chat_torrents: Dict[str, Dict[str, str]] = {chat_id: {} for chat_id in self.chat_ids}
+        for torrent_id, torrent in self.torrent_manager.torrents.items():
+            chat_torrents[torrent.options['delugram_chat_id']][torrent_id] = torrent.status['name']
+        return chat_torrents
+
+    def enable_core(self, config_dir, **prefs):
+        """
+        Creates and enables delugram's Core with every chat registered, on a FakeConfig holding prefs.
+        The ownership store is created in config_dir.
+        """
+        config = FakeConfig('delugram.conf', DEFAULT_PREFS)
+        config['chats'] = [{'chat_id': chat_id, 'name': chat_id} for chat_id in self.chat_ids]
+        for key, value in prefs.items():
+            config[key] = value
+
+        deluge.configmanager.set_config_dir(config_dir)
+        core = Core('Delugram')
+        with mock.patch.object(delugram.core.deluge.configmanager, 'ConfigManager', lambda name, defaults: config):
+            core.enable()
+        return core
+
+    def shutdown(self):
+        for name in ('TorrentManager', 'Core', 'EventManager', 'RPCServer', 'CorePlugin.Delugram'):
+            component._ComponentRegistry.components.pop(name, None)
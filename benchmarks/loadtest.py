@@ -0,0 +1,183 @@
+"""
+End-to-end load test: the real bot, talking to a local fake Bot API server (benchmarks.botapi).
+
+    python -m benchmarks.loadtest --chats 200 --scenario mixed > loadtest.json
+
+Core is enabled against the fakes in benchmarks.fakes with telegram_base_url pointing at the fake
+server, and runs the way it does inside deluge: components on the twisted reactor in the main thread,
+the bot on its own loop thread. Every simulated chat adds a torrent through the /add conversation
+(a magnet link, a .torrent file or either, depending on the scenario) and waits for the "Torrent added"
+notification. The report has the throughput and per step latency percentiles as JSON.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from deluge.bencode import bencode
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from benchmarks.botapi import ChatScript, FakeBotApi, Step
+from benchmarks.fakes import FakeDeluge, TORRENT_METADATA
+from delugram.metrics import LOOP_STALLS
+
+TOKEN = '123456:LOADTEST'
+SCENARIOS = ('magnet', 'torrent', 'mixed')
+
+
+def magnet_steps(rng: random.Random):
+    return [
+        Step('add', '/add', "Select type of torrent source"),
+        Step('magnet_type', 'Magnet', "Send the magnet link"),
+        Step('magnet', 'magnet:?xt=urn:btih:%040x&dn=Load' % rng.getrandbits(160), "Torrent added"),
+        Step('done', '/done', "Finished adding"),
+    ]
+
+
+def torrent_steps(rng: random.Random):
+    return [
+        Step('add', '/add', "Select type of torrent source"),
+        Step('torrent_type', '.torrent', "Send the torrent file"),
+        Step('torrent', 'load.torrent', "Torrent added", document=bencode({b'info': TORRENT_METADATA})),
+        Step('done', '/done', "Finished adding"),
+    ]
+
+
+def build_scripts(chat_ids, scenario, rng: random.Random):
+    scripts = []
+    for i, chat_id in enumerate(chat_ids):
+        use_magnet = scenario == 'magnet' or (scenario == 'mixed' and i % 2 == 0)
+        scripts.append(ChatScript(int(chat_id), magnet_steps(rng) if use_magnet else torrent_steps(rng)))
+    return scripts
+
+
+def run(chats, scenario, timeout, chat_rate=None, global_rate=None):
+    fakes = FakeDeluge(0, chats)
+    api = FakeBotApi(TOKEN, build_scripts(fakes.chat_ids, scenario, random.Random(chats)))
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='fake Bot API', daemon=True).start()
+    asyncio.run_coroutine_threadsafe(api.start(), loop).result()
+
+    outcome = {}
+    config_dir = tempfile.TemporaryDirectory()
+
+    def drive():
+        core = None
+        try:
+            core = reactor_call(lambda: fakes.enable_core(config_dir.name, telegram_token=TOKEN,
+                                                          telegram_base_url=api.url,
+                                                          notification_digest_window=0))
+            # wait for the bot to start polling before sending anything
+            deadline = time.monotonic() + 30
+            while api.calls['getUpdates'] == 0 or core.outbox is None:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("The bot didn't start polling")
+                time.sleep(0.05)
+
+            if chat_rate is not None or global_rate is not None:
+                tune_outbox(core.outbox, chat_rate, global_rate)
+
+            loop.call_soon_threadsafe(api.begin)
+            try:
+                asyncio.run_coroutine_threadsafe(asyncio.wait_for(api.finished.wait(), timeout), loop).result()
+            except asyncio.TimeoutError:
+                outcome['timed_out'] = True
+        except Exception as e:
+            outcome['error'] = repr(e)
+        finally:
+            if core is not None:
+                reactor_call(core.disable)
+            reactor.callFromThread(reactor.stop)
+
+    def reactor_call(func):
+        done = threading.Event()
+        result = {}
+
+        def finished(value):
+            if isinstance(value, Failure):
+                result['error'] = value.value
+            else:
+                result['value'] = value
+            done.set()
+
+        # like deluge, wait for the Deferred func may return (disable does)
+        reactor.callFromThread(lambda: defer.maybeDeferred(func).addBoth(finished))
+        done.wait()
+        if 'error' in result:
+            raise result['error']
+        return result.get('value', None)
+
+    reactor.callWhenRunning(lambda: threading.Thread(target=drive, name='load test', daemon=True).start())
+    reactor.run(installSignalHandlers=False)
+
+    asyncio.run_coroutine_threadsafe(api.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    fakes.shutdown()
+    config_dir.cleanup()
+
+    stalls = {sample['labels']['handler']: sample['value'] for sample in LOOP_STALLS.samples()}
+    return {**api.report(), 'loop_stalls': stalls, **outcome}
+
+
+def tune_outbox(outbox, chat_rate, global_rate):
+    """Replaces the outbox's rate limits, e.g. to find out how the bot does without telegram's limits"""
+    from delugram.outbox import TokenBucket
+
+    if global_rate is not None:
+        outbox.global_rate = global_rate
+        outbox.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+    if chat_rate is not None:
+        outbox.chat_rate = chat_rate
+        outbox.chat_burst = max(chat_rate, 1)
+        outbox.chat_buckets.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+                                     description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chats', type=int, default=100, help="number of simulated chats (default: %(default)s)")
+    parser.add_argument('--scenario', choices=SCENARIOS, default='mixed',
+                        help="how the chats add their torrent (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for all chats to finish "
+                                                                   "(default: %(default)s)")
+    parser.add_argument('--chat-rate', type=float, help="messages per second per chat, instead of telegram's limit")
+    parser.add_argument('--global-rate', type=float, help="messages per second overall, instead of telegram's limit")
+    parser.add_argument('--strict', action='store_true',
+                        help="exit with status 1 if a handler blocked the bot's event loop")
+    parser.add_argument('--output', help="write the report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    for name in ('delugram', 'telegram', 'httpx'):
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scenario': args.scenario,
+        **run(args.chats, args.scenario, args.timeout, args.chat_rate, args.global_rate),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+    if args.strict and report['loop_stalls']:
+        sys.stderr.write(f"The event loop stalled in {', '.join(report['loop_stalls'])}\n")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
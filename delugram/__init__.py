@@ -1,16 +1,30 @@
-
+import os
 import sys
+from importlib.metadata import PackageNotFoundError, distribution
+
 from delugram.logger import log
 
-import pkg_resources
 from deluge.plugins.init import PluginInitBase
 
+_libs_loaded = False
+
 
 def load_libs():
-    egg = pkg_resources.require("Delugram")[0]
-    for name in egg.get_entry_map("delugram.libpaths"):
-        ep = egg.get_entry_info("delugram.libpaths", name)
-        location = "%s/%s" % (egg.location, ep.module_name.replace(".", "/"))
+    """Adds the paths listed under the delugram.libpaths entry point to sys.path, once per process."""
+    global _libs_loaded
+    if _libs_loaded:
+        return
+    _libs_loaded = True
+
+    try:
+        dist = distribution("Delugram")
+    except PackageNotFoundError:
+        return
+
+    for ep in dist.entry_points:
+        if ep.group != "delugram.libpaths":
+            continue
+        location = os.path.join(str(dist.locate_file('')), *ep.value.split("."))
         if location not in sys.path:
             sys.path.append(location)
         log.info("Appending to sys.path: '%s'" % location)
@@ -1,9 +1,15 @@
 from __future__ import unicode_literals
 
-import os.path
+import atexit
+import contextlib
+import functools
+from importlib.resources import as_file, files
 
-from pkg_resources import resource_filename
+# keeps resources extracted from a zipped egg around until exit
+_resources = contextlib.ExitStack()
+atexit.register(_resources.close)
 
 
+@functools.lru_cache(maxsize=None)
 def get_resource(filename):
-    return resource_filename(__package__, os.path.join('data', filename))
+    return str(_resources.enter_context(as_file(files(__package__) / 'data' / filename)))
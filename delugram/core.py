@@ -1,22 +1,31 @@
-from __future__ import unicode_literals
+from __future__ import annotations, unicode_literals
 
+import hmac
 import html
+import io
 import json
 import math
+import re
+import secrets
 import traceback
-import urllib
-from base64 import b64encode, b64decode
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Optional, Set
+from urllib.parse import parse_qs, urlsplit
 
 import asyncio
 import threading
+import time
 
-from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup
-from telegram.constants import ParseMode
-from telegram.ext import ConversationHandler, CommandHandler, MessageHandler, ContextTypes, filters, \
-    Application, ApplicationBuilder, ApplicationHandlerStop
-
+from delugram.httpserver import HttpListener
 from delugram.logger import log
+from delugram.metrics import (DELUGE_EVENT_ERRORS, DELUGE_EVENT_SECONDS, REGISTRY, TELEGRAM_HANDLER_ERRORS,
+                              TELEGRAM_HANDLER_SECONDS, timed)
+from delugram.pagecache import PageCache
+from delugram.persistence import WriteBehind
+from delugram.prefetch import MagnetPrefetcher, magnet_info_hash
+from delugram.profiling import LoopProfiler
+from delugram.snapshot import StatusSnapshot
+from delugram.store import OwnershipStore
+from delugram.watchdog import LoopWatchdog
 
 from deluge.event import DelugeEvent
 import deluge.configmanager
@@ -24,16 +33,73 @@ from deluge import component
 from deluge.common import fsize, ftime, fdate, fpeer, fpcnt, fspeed, is_magnet, is_url
 from deluge.core.rpcserver import export
 from deluge.plugins.pluginbase import CorePluginBase
-from deluge.bencode import bdecode
-from deluge.ui.common import TorrentInfo
+from twisted.internet import defer, reactor, threads
+from twisted.internet.task import LoopingCall
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
+
+    from delugram.dashboard import LiveDashboard
+    from delugram.digest import NotificationDigest
+    from delugram.fetcher import TorrentFetcher
+    from delugram.outbox import Outbox
+
+
+def load_telegram():
+    """
+    Imports python-telegram-bot (and the modules built on it) into this module's namespace. Importing it
+    takes a good part of a second, so it is put off until a bot is actually started with a valid token.
+    """
+    global Update, ReplyKeyboardRemove, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup, \
+        ParseMode, BadRequest, ConversationHandler, CommandHandler, MessageHandler, ContextTypes, filters, \
+        Application, ApplicationBuilder, ApplicationHandlerStop, CallbackQueryHandler, TypeHandler, \
+        LiveDashboard, NotificationDigest, split_message, FetchError, TorrentFetcher, \
+        Outbox, PRIORITY_ADMIN, PRIORITY_NOTIFICATION, PRIORITY_REPLY
+
+    from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.constants import ParseMode
+    from telegram.error import BadRequest
+    from telegram.ext import ConversationHandler, CommandHandler, MessageHandler, ContextTypes, filters, \
+        Application, ApplicationBuilder, ApplicationHandlerStop, CallbackQueryHandler, TypeHandler
+
+    from delugram.dashboard import LiveDashboard
+    from delugram.digest import NotificationDigest, split_message
+    from delugram.fetcher import FetchError, TorrentFetcher
+    from delugram.outbox import Outbox, PRIORITY_ADMIN, PRIORITY_NOTIFICATION, PRIORITY_REPLY
+
 
 DEFAULT_PREFS = {
     "telegram_token": "Contact @BotFather, create a new bot and get a bot token",
     "admin_chat_id": "Telegram chat id of the administrator. Use @userinfobot to get the chat id",
     "chats": [],
-    "chat_torrents": {},
+    # seconds to collect added/finished notifications for a chat into one digest message (0 to disable).
+    # can be overridden per chat with a "digest_window" key on the chat's entry in "chats"
+    "notification_digest_window": 5,
+    # "polling" or "webhook". in webhook mode updates are received on a local http listener, usually behind a
+    # reverse proxy. webhook_url is registered with telegram when set, leave it empty when the webhook is
+    # managed elsewhere (or updates are pushed by a local fake Bot API). every webhook request has to carry
+    # webhook_secret, a random one is generated when it is empty
+    "update_mode": "polling",
+    "webhook_listen": "127.0.0.1",
+    "webhook_port": 8443,
+    "webhook_path": "/delugram",
+    "webhook_url": "",
+    "webhook_secret": "",
+    # Bot API server to talk to instead of https://api.telegram.org, e.g. a local Bot API server or
+    # the fake one used for load testing (see benchmarks/botapi.py). leave empty for telegram's own
+    "telegram_base_url": "",
+    # port of an http listener serving the metrics (see get_metrics) in prometheus' text format on
+    # /metrics while the bot runs. 0 disables it
+    "metrics_listen": "127.0.0.1",
+    "metrics_port": 0,
+    # seconds a handler may block the bot's event loop before the stack is logged (0 disables the watchdog)
+    "loop_stall_threshold": 0.5,
 }
 
+# port prefs and the lowest value they accept, metrics_port is 0 when the metrics listener is disabled
+PORT_PREFS = {'webhook_port': 1, 'metrics_port': 0}
+
 HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 ' +
                          '(KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36'}
 
@@ -68,6 +134,111 @@ INFO_DICT = (('queue', lambda i, s: i != -1 and str(i) or '#'),
 
 INFOS = [i[0] for i in INFO_DICT]
 
+PAGE_SIZE = 10
+
+# status keys listings are filtered and ordered by, fetched for all of a chat's torrents before the full
+# status of the page being shown
+ORDER_KEYS = ('state', 'time_added')
+
+STATUS_STATES = ('Active', 'Downloading', 'Seeding', 'Paused', 'Checking', 'Error', 'Queued')
+ONGOING_STATES = ('Downloading', 'Queued')
+
+# torrent lists that can be paged through with inline buttons, and the states they show
+LISTINGS = {'status': STATUS_STATES, 'ongoing': ONGOING_STATES}
+# seconds the ordering of a listing is reused by its page buttons before it is taken again
+LISTING_TTL = 10 * 60
+
+# seconds a rendered /status or /ongoing page is served from memory, unless a torrent event invalidates it first
+STATUS_CACHE_TTL = 5
+
+# seconds to wait for config changes to settle before writing delugram.conf, and the upper bound
+# on how long a change may stay unsaved while changes keep coming in
+CONFIG_SAVE_DELAY = 2
+CONFIG_SAVE_MAX_DELAY = 30
+
+MAGNET_PATTERN = re.compile(r'magnet:\?\S+', re.IGNORECASE)
+URL_PATTERN = re.compile(r'https?://\S+', re.IGNORECASE)
+
+# text documents with links larger than this are ignored
+MAX_TEXT_DOCUMENT_SIZE = 1024 * 1024
+
+# seconds to wait for the rest of a media group (album) of .torrent files after its first file arrives
+MEDIA_GROUP_DELAY = 1
+
+# magnet metadata fetches running at the same time, more are queued
+MAX_CONCURRENT_PREFETCHES = 4
+
+# seconds the label list is cached for, the label plugin doesn't emit events when labels are added or removed
+LABEL_CACHE_TTL = 60
+
+# seconds during which updates from an unauthorized chat are dropped without logging or replying again
+REJECTION_INTERVAL = 60
+
+# sqlite database (in deluge's config dir) holding which chat added which torrent
+OWNERSHIP_DB = 'delugram.db'
+# directory in deluge's config dir that profiles of the bot's event loop are written to
+PROFILES_DIR = 'delugram-profiles'
+
+# seconds to collect TorrentRemovedEvents before dropping them from the ownership store in one go
+REMOVAL_BATCH_DELAY = 1
+# seconds between full reconciliations of the ownership store against the torrents known to deluge
+CLEANUP_INTERVAL = 6 * 60 * 60
+
+# seconds queued messages get to go out when the bot stops
+OUTBOX_STOP_TIMEOUT = 5
+# seconds the bot gets to shut down (listeners, PTB, outbox, http client) before the rest is released and
+# its event loop is stopped regardless. larger than the outbox's share so a graceful stop normally fits in it
+BOT_STOP_TIMEOUT = 20
+# seconds to wait for the event loop thread to exit once its loop is stopped, on top of BOT_STOP_TIMEOUT
+LOOP_THREAD_JOIN_TIMEOUT = 5
+
+
+def parse_port(key, value, minimum=1):
+    """Returns value as a port number, raises ValueError if it isn't one (web ui number fields send '' when cleared)"""
+    try:
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        port = int(value) if isinstance(value, (int, float)) else int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Invalid {key}: {value!r} is not a number")
+    if not minimum <= port <= 65535:
+        raise ValueError(f"Invalid {key}: {port} is not between {minimum} and 65535")
+    return port
+
+
+def extract_links(text, pattern, is_valid, key=None):
+    """Returns the valid links found in text, without duplicates, in the order they appear"""
+    links = {}
+    for match in pattern.finditer(text or ''):
+        link = match.group(0)
+        if is_valid(link):
+            links.setdefault(key(link) if key else link, link)
+    return list(links.values())
+
+
+def message_link_text(message):
+    """
+    Returns the text of a message followed by the urls of its text links (links behind formatted text,
+    which aren't part of the text itself), for extract_links to find the links of the message in.
+    """
+    urls = [entity.url for entity in message.entities or () if entity.type == 'text_link' and entity.url]
+    return '\n'.join([message.text or ''] + urls)
+
+
+def link_display_name(link, length=80):
+    """Short human readable name of a magnet (its dn, if any) or url"""
+    if is_magnet(link):
+        names = parse_qs(urlsplit(link).query).get('dn', None)
+        if names:
+            link = names[0]
+    return link if len(link) <= length else link[:length - 1] + '…'
+
+
+def is_torrent_document(document):
+    """Whether a document sent to the bot looks like a .torrent file, by its mime type and extension"""
+    return document.mime_type == 'application/x-bittorrent' and \
+        (document.file_name or '').lower().endswith('.torrent')
+
 
 class DelugramPollingStatusChangedEvent(DelugeEvent):
     """Emitted when the Delugram polling status changes."""
@@ -76,6 +247,23 @@ class DelugramPollingStatusChangedEvent(DelugeEvent):
         pass
 
 
+class StartupTimer(object):
+    """Collects how long each step of a startup took, for a one line report"""
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.laps: List[Any] = []
+
+    def lap(self, step):
+        now = time.perf_counter()
+        self.laps.append((step, now - self.last))
+        self.last = now
+
+    def __str__(self):
+        steps = ', '.join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in self.laps)
+        return f"{(self.last - self.started) * 1000:.0f}ms ({steps})"
+
+
 class InvalidTokenError(Exception):
     def __init__(self, message: str = "Invalid token provided or token not set"):
         super().__init__(message)
@@ -90,41 +278,109 @@ class Core(CorePluginBase):
         self.event_manager: Optional[Any] = None
         self.label_plugin: Optional[Any] = None
         self.available_labels: Optional[List[str]] = None
+        self.label_lookup: Dict[str, str] = {}
+        self.labels_loaded_at: Optional[float] = None
         self.config: Optional[Any] = None
+        self.config_writer: Optional[WriteBehind] = None
+        self.store: Optional[OwnershipStore] = None
+        self.torrent_chats: Dict[str, str] = {}
+        self.permitted_chats: FrozenSet[str] = frozenset()
+        self.rejected_chats: Dict[int, float] = {}
+        self.pending_removals: Set[str] = set()
+        self.removal_call: Optional[Any] = None
+        self.status_pages = PageCache(ttl=STATUS_CACHE_TTL)
+        self.cleanup_loop: Optional[LoopingCall] = None
         self.telegram: Optional[Application] = None
         self.commands: Optional[Dict[Any, Any]] = None
         self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.thread: Optional[threading.Thread] = None
+        self.fetcher: Optional[TorrentFetcher] = None
+        self.outbox: Optional[Outbox] = None
+        self.digest: Optional[NotificationDigest] = None
+        self.dashboard: Optional[LiveDashboard] = None
+        self.webhook: Optional[HttpListener] = None
+        self.metrics_listener: Optional[HttpListener] = None
+        self.profiler: Optional[LoopProfiler] = None
+        self.watchdog: Optional[LoopWatchdog] = None
+        self.prefetcher: Optional[MagnetPrefetcher] = None
+        self.background_tasks: Set[asyncio.Task] = set()
+        self.media_groups: Dict[Any, List[Any]] = {}
 
     def enable(self):
+        timings = StartupTimer()
+
         # hydrate
         self.core = component.get('Core')
         self.config = deluge.configmanager.ConfigManager('delugram.conf', DEFAULT_PREFS)
+        self.config_writer = WriteBehind(self.config.save, delay=CONFIG_SAVE_DELAY, max_delay=CONFIG_SAVE_MAX_DELAY)
+        timings.lap('config')
+        self.store = OwnershipStore(deluge.configmanager.get_config_dir(OWNERSHIP_DB),
+                                    delay=CONFIG_SAVE_DELAY, max_delay=CONFIG_SAVE_MAX_DELAY)
+        self.migrate_chat_torrents()
+        timings.lap('ownership store')
         self.torrent_manager = component.get("TorrentManager")
         self.event_manager = component.get("EventManager")
         self.label_plugin = None
         self.available_labels = self.load_available_labels()
+        timings.lap('labels')
+        self.rebuild_chat_permissions()
+        self.rebuild_torrent_chat_index()
+        timings.lap('index')
+        self.profiler = LoopProfiler(deluge.configmanager.get_config_dir(PROFILES_DIR))
 
         try:
+            if self.is_telegram_token_set():
+                load_telegram()
+                timings.lap('telegram import')
             self.initialize_telegram_bot()
             self.start_telegram_polling()
+            timings.lap('telegram bot')
         except InvalidTokenError:
             log.error(f"Invalid telegram bot api token provided or token not set. Telegram will not be initialized \
                         during Delugram enable. Please set a valid token in the plugin preferences and restart \
                         Delugram.")
 
         self.register_deluge_event_handlers()
+        self.register_metrics()
+
+        # full ownership reconciliation is only needed to catch removals missed while delugram was
+        # disabled, so it runs rarely, and once the session has loaded its torrents. when deluge starts up,
+        # plugins are enabled before the TorrentManager, which announces it with SessionStartedEvent (see
+        # _on_session_started). when delugram is enabled later on, the session is already there
+        self.cleanup_loop = LoopingCall(self.cleanup_chat_torrents)
+        self.cleanup_loop.start(CLEANUP_INTERVAL, now=self.torrent_manager.get_state() == 'Started')
+        timings.lap('event handlers')
 
-        log.debug('Plugin enabled.')
+        log.info(f"Plugin enabled in {timings}")
 
     def disable(self):
-        self.config.save()
+        """
+        Stops the bot without blocking the reactor, which handlers that are still running may be waiting
+        on. Returns a Deferred firing once the plugin is disabled.
+        """
+        if self.cleanup_loop and self.cleanup_loop.running:
+            self.cleanup_loop.stop()
+
+        if self.removal_call and self.removal_call.active():
+            self.removal_call.cancel()
+        self.process_pending_removals()
+
+        self.config_writer.mark_dirty()
+        self.config_writer.flush()
 
-        self.stop_telegram_polling()
+        if self.profiler.running:
+            self.profiler.stop()
+        return self.stop_telegram_polling().addBoth(self._on_telegram_stopped_for_disable)
+
+    def _on_telegram_stopped_for_disable(self, result):
+        self.store.writer.flush()
+        self.store.close()
 
         self.deregister_deluge_event_handlers()
+        self.deregister_metrics()
 
         log.debug('Plugin disabled')
+        return result
 
     def update(self):
         pass
@@ -136,19 +392,22 @@ class Core(CorePluginBase):
 
     @export
     def set_config(self, config):
-        """Sets the config dictionary"""
+        """Sets the config dictionary. Raises ValueError, leaving the config untouched, on an invalid port."""
+        config = dict(config)
+        for key, minimum in PORT_PREFS.items():
+            if key in config:
+                config[key] = parse_port(key, config[key], minimum)
+
         for key in config:
             self.config[key] = config[key]
-        self.config.save()
+        self.save_config()
+        if 'chats' in config:
+            self.rebuild_chat_permissions()
 
     @export
     def get_config(self):
         """Returns the config dictionary"""
-        polling = False
-        if self.telegram and self.telegram.updater.running:
-            polling = True
-
-        return {**self.config.config, 'polling': polling}
+        return {**self.config.config, 'polling': self.is_receiving_updates()}
 
     @export
     def add_chat(self, chat_id, name):
@@ -157,31 +416,82 @@ class Core(CorePluginBase):
 
         if next((item for item in self.config['chats'] if item["chat_id"] == chat_id), None) is None:
             self.config['chats'].append({"chat_id": chat_id, "name": name})
-            self.config.save()
+            self.save_config()
+            self.rebuild_chat_permissions()
+            # torrents owned by a previously deregistered chat become visible to it again
+            self.index_chat_torrents(chat_id)
             return True
         return False
 
     @export
     def remove_chat(self, chat_id):
         self.config['chats'] = [item for item in self.config['chats'] if item["chat_id"] != chat_id]
-        self.config.save()
+        self.save_config()
+        self.rebuild_chat_permissions()
+        self.unindex_chat_torrents(chat_id)
         return True
 
+    @export
+    def set_chat_digest_window(self, chat_id, seconds):
+        """Sets how many seconds notifications for chat_id are collected into one digest message"""
+        seconds = float(seconds)
+        if seconds < 0:
+            raise ValueError("Digest window can't be negative")
+
+        for item in self.config['chats']:
+            if item["chat_id"] == str(chat_id):
+                item["digest_window"] = seconds
+                self.save_config()
+                return True
+        return False
+
+    @export
+    def get_cache_stats(self):
+        """Returns hit/miss counters of delugram's caches, for tuning their lifetimes"""
+        return {'status_pages': self.status_pages.stats()}
+
+    @export
+    def get_metrics(self):
+        """
+        Returns delugram's metrics: handler and Bot API latency histograms, error counters and queue
+        depths, as {name: {'type', 'help', 'samples'}}. Latencies are in seconds.
+        """
+        return REGISTRY.collect()
+
+    @export
+    def start_profiling(self, mode='sampling', duration=60, memory=False):
+        """
+        Profiles the bot's event loop thread for `duration` seconds, with a sampling profiler ('sampling')
+        or cProfile ('cprofile'), optionally tracing memory allocations too. The results are written to
+        the delugram-profiles directory in deluge's config dir, see stop_profiling.
+        """
+        if not self.loop or not self.thread:
+            raise RuntimeError("The telegram bot isn't running")
+        return self.profiler.start(self.loop, self.thread.ident, mode, float(duration), bool(memory))
+
+    @export
+    def stop_profiling(self):
+        """Stops profiling early. Returns the paths of the files written, or of the last profile."""
+        # stopping cProfile waits for the event loop, which must not hold up the reactor
+        return threads.deferToThread(self.profiler.stop)
+
     @export
     def reload_telegram(self, config=None):
         if config and isinstance(config, dict):
             self.set_config(config)
 
-        self.stop_telegram_polling()
+        def restart(_):
+            self.initialize_telegram_bot()
+            self.start_telegram_polling()
 
-        self.initialize_telegram_bot()
-        self.start_telegram_polling()
+        return self.stop_telegram_polling().addCallback(restart)
 
 
     #########
     #  Section: Event Handlers
     #########
 
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
     def _on_torrent_added(self, torrent_id, from_state=False):
         """
         This is called when a torrent is added.
@@ -207,35 +517,56 @@ class Core(CorePluginBase):
             log.warning(f"Chat ID not found in torrent options. {torrent_id}")
             return
 
+        # a torrent re-added before its removal was processed must not be dropped by the pending batch
+        self.pending_removals.discard(str(torrent_id))
         self.add_torrent_for_chat(chat_id=chat_id, torrent_id=str(torrent_id), torrent_name=torrent_name)
+        self.status_pages.invalidate(str(chat_id))
 
         owner = self.get_torrent_chat(torrent_id)
         if not owner:
-            log.warning(f"Owner not found for torrent {torrent_id}. chat_torrents: {self.config['chat_torrents']}")
+            log.warning(f"Owner not found for torrent {torrent_id}")
             return
 
-        message = "Torrent added: *%s*" % html.escape(torrent_name)
+        log.debug(f'Owner: {owner}, Torrent: {torrent_name}, Event: added')
 
-        log.debug(f'Owner: {owner}, Torrent: {torrent_name}, Message: {message}')
+        self.notify_torrent_event(owner, 'added', torrent_name)
 
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
+    def _on_torrent_removed(self, torrent_id):
         """
-        for some reason deluge events run in a separate thread, so we need to run send_message coroutine
-        in the main thread
+        This is called when a torrent is removed.
+        Removals are collected for a moment so mass removals are handled as one batch.
         """
-        if self.loop and self.loop.is_running():
-            asyncio.run_coroutine_threadsafe(
-                self.telegram.bot.send_message(chat_id=owner, text=message, parse_mode=ParseMode.HTML),
-                self.loop
-            )
-        else:
-            log.error("No running event loop available to send Telegram message!")
+        self.pending_removals.add(str(torrent_id))
+        self.invalidate_torrent_pages(torrent_id)
 
-    def _on_torrent_removed(self, torrent_id):
+        if self.removal_call is None or not self.removal_call.active():
+            self.removal_call = reactor.callLater(REMOVAL_BATCH_DELAY, self.process_pending_removals)
+
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
+    def _on_torrent_state_changed(self, torrent_id, state):
         """
-        This is called when a torrent is removed.
+        This is called when a torrent changes state (e.g. from Downloading to Seeding).
+        """
+        self.invalidate_torrent_pages(torrent_id)
+
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
+    def _on_session_started(self):
+        """
+        This is called once deluge has finished loading its torrents.
         """
         self.cleanup_chat_torrents()
 
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
+    def _on_plugin_changed(self, plugin_name):
+        """
+        This is called when a plugin is enabled or disabled.
+        """
+        if plugin_name == 'Label':
+            # reload the labels (or notice they're gone) on next use
+            self.labels_loaded_at = None
+
+    @timed(DELUGE_EVENT_SECONDS, DELUGE_EVENT_ERRORS)
     def _on_torrent_finished(self, torrent_id):
         """
         This is called when a torrent is finished.
@@ -255,21 +586,10 @@ class Core(CorePluginBase):
         if not owner:
             return
 
-        message = "Torrent finished: *%s*" % html.escape(torrent_name)
-
-        log.debug(f'Owner: {owner}, Torrent: {torrent_name}, Message: {message}')
+        self.status_pages.invalidate(owner)
+        log.debug(f'Owner: {owner}, Torrent: {torrent_name}, Event: finished')
 
-        """
-        for some reason deluge events run in a separate thread, so we need to run send_message coroutine
-        in the main thread
-        """
-        if self.loop and self.loop.is_running():
-            asyncio.run_coroutine_threadsafe(
-                self.telegram.bot.send_message(chat_id=owner, text=message, parse_mode=ParseMode.HTML),
-                self.loop
-            )
-        else:
-            log.error("No running event loop available to send Telegram message!")
+        self.notify_torrent_event(owner, 'finished', torrent_name)
 
     async def tg_on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Log the error and send a telegram message to notify the developer."""
@@ -308,13 +628,13 @@ class Core(CorePluginBase):
         )
 
         # Finally, send the message
-        await context.bot.send_message(
-            chat_id=self.config['admin_chat_id'], text=message, parse_mode=ParseMode.HTML
+        await self.send_message(
+            self.config['admin_chat_id'], text=message, parse_mode=ParseMode.HTML, priority=PRIORITY_ADMIN
         )
 
         #notify original chat of the error
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
+        await self.send_message(
+            update.effective_chat.id,
             text="An error occurred. Administrator has been notified.",
             reply_markup=ReplyKeyboardRemove()
         )
@@ -349,14 +669,17 @@ class Core(CorePluginBase):
                         ],
                         ADD_MAGNET_STATE: [
                             MessageHandler(filters.TEXT & ~filters.COMMAND, self.add_magnet_state_handler),
+                            MessageHandler(filters.Document.FileExtension('txt'), self.add_magnet_document_handler),
                             MessageHandler(filters.ALL & ~filters.COMMAND, self.invalid_input_handler),
                         ],
                         ADD_TORRENT_STATE: [
-                            MessageHandler(filters.Document.FileExtension('torrent'), self.add_torrent_state_handler),
+                            # any document, so a stray file in an album is reported along with the rest of it
+                            MessageHandler(filters.Document.ALL, self.add_torrent_state_handler),
                             MessageHandler(filters.ALL & ~filters.COMMAND, self.invalid_input_handler),
                         ],
                         ADD_URL_STATE: [
                             MessageHandler(filters.TEXT & ~filters.COMMAND, self.add_url_state_handler),
+                            MessageHandler(filters.Document.FileExtension('txt'), self.add_url_document_handler),
                             MessageHandler(filters.ALL & ~filters.COMMAND, self.invalid_input_handler),
                         ]
                     },
@@ -380,6 +703,18 @@ class Core(CorePluginBase):
                 'handler': CommandHandler('ongoing', self.ongoing_command_handler),
                 'list_in_help': True
             },
+            {
+                'name': 'watch',
+                'description': 'Keep a message with your ongoing torrents up to date',
+                'handler': CommandHandler('watch', self.watch_command_handler),
+                'list_in_help': True
+            },
+            {
+                'name': 'unwatch',
+                'description': 'Stop updating the /watch message',
+                'handler': CommandHandler('unwatch', self.unwatch_command_handler),
+                'list_in_help': True
+            },
             {
                 'name': 'cancel',
                 'description': 'Cancels the current operation',
@@ -420,47 +755,193 @@ class Core(CorePluginBase):
         if not self.is_telegram_token_set():
             raise InvalidTokenError()
 
+        load_telegram()
         self.define_telegram_commands()
 
-        self.telegram = ApplicationBuilder().token(self.config['telegram_token']).build()
+        # webhook requests are only trusted when they carry the secret token, so one is needed for anyone
+        # reaching the listener not to be able to post updates as a permitted chat
+        if self.config['update_mode'] == 'webhook' and not self.config['webhook_secret']:
+            self.config['webhook_secret'] = secrets.token_urlsafe(32)
+            self.save_config()
+            log.info("Generated a webhook secret token")
+
+        builder = ApplicationBuilder().token(self.config['telegram_token'])
+        if self.config['telegram_base_url']:
+            base_url = self.config['telegram_base_url'].rstrip('/')
+            builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+        self.telegram = builder.build()
 
         # register tg middleware
-        self.telegram.add_handler(MessageHandler(filters.ALL, self.tg_middleware), group=0)
+        # every kind of update (also callback queries from inline buttons) has to pass the middleware
+        self.telegram.add_handler(TypeHandler(Update, self.tg_middleware), group=0)
 
         # register command handlers to telegram
         for cmd in self.commands:
-            self.telegram.add_handler(cmd['handler'], group=1)
+            self.telegram.add_handler(self.instrument_handler(cmd['handler']), group=1)
+        self.telegram.add_handler(self.instrument_handler(
+            CallbackQueryHandler(self.page_callback_handler, pattern=r'^page:')
+        ), group=1)
 
         # register error handlers to telegram
         self.telegram.add_error_handler(self.tg_on_error)
 
+    def instrument_handler(self, handler):
+        """Records the latency and exceptions of handler's callback, or of every handler of a conversation"""
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + [h for hs in handler.states.values() for h in hs] + handler.fallbacks:
+                self.instrument_handler(nested)
+        else:
+            handler.callback = timed(TELEGRAM_HANDLER_SECONDS, TELEGRAM_HANDLER_ERRORS)(handler.callback)
+        return handler
+
     async def start_telegram_bot(self):
+        if self.config['loop_stall_threshold']:
+            self.watchdog = LoopWatchdog(float(self.config['loop_stall_threshold']))
+            await self.watchdog.start()
+
+        self.fetcher = TorrentFetcher(headers=HEADERS)
+        await self.fetcher.start()
+        self.prefetcher = MagnetPrefetcher(
+            lambda magnet: self.run_in_reactor(self.core.prefetch_magnet_metadata, magnet),
+            max_concurrent=MAX_CONCURRENT_PREFETCHES
+        )
+
         await self.telegram.initialize()
+
+        self.outbox = Outbox(self.telegram.bot)
+        await self.outbox.start()
+        self.digest = NotificationDigest(self.outbox)
+        self.dashboard = LiveDashboard(self.outbox, self.render_watched_chats)
+
         await self.telegram.start()
-        await self.telegram.updater.start_polling(poll_interval=0.5)
+
+        if self.config['metrics_port']:
+            self.metrics_listener = HttpListener(self.config['metrics_listen'], int(self.config['metrics_port']),
+                                                 self.handle_metrics_request, name='metrics')
+            await self.metrics_listener.start()
+
+        if self.config['update_mode'] == 'webhook':
+            await self.start_telegram_webhook()
+        else:
+            await self.telegram.updater.start_polling(poll_interval=0.5)
 
         self.event_manager.emit(DelugramPollingStatusChangedEvent())
 
-        log.info("Telegram Bot started with polling in a separate thread using asyncio event loops")
+        log.info(f"Telegram Bot started with {self.config['update_mode']} in a separate thread using asyncio event loops")
+
+    async def start_telegram_webhook(self):
+        self.webhook = HttpListener(self.config['webhook_listen'], int(self.config['webhook_port']),
+                                    self.handle_webhook_request, name='Telegram webhook')
+        await self.webhook.start()
+
+        if self.config['webhook_url']:
+            await self.telegram.bot.set_webhook(
+                url=self.config['webhook_url'],
+                secret_token=self.config['webhook_secret'],
+                allowed_updates=Update.ALL_TYPES
+            )
+
+    async def handle_webhook_request(self, method, path, headers, body):
+        """Feeds updates posted to the webhook listener into the application's update queue."""
+        if path.split('?', 1)[0] != self.config['webhook_path']:
+            return 404, 'text/plain', b''
+
+        if method != 'POST':
+            return 405, 'text/plain', b''
+
+        secret = self.config['webhook_secret'].encode('utf-8')
+        token = headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8', errors='replace')
+        if not secret or not hmac.compare_digest(token, secret):
+            log.warning("Rejected webhook request with invalid secret token")
+            return 403, 'text/plain', b''
+
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict) or 'update_id' not in data:
+                raise ValueError("Not an update")
+            update = Update.de_json(data, self.telegram.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, 'text/plain', b''
+
+        await self.telegram.update_queue.put(update)
+        return 200, 'text/plain', b''
+
+    async def handle_metrics_request(self, method, path, headers, body):
+        """Serves the metrics registry to prometheus"""
+        if path.split('?', 1)[0] != '/metrics':
+            return 404, 'text/plain', b''
+        if method != 'GET':
+            return 405, 'text/plain', b''
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render().encode('utf-8')
 
     async def stop_telegram_bot(self):
+        """
+        Shuts the bot down gracefully, giving up after BOT_STOP_TIMEOUT seconds (PTB waits for running
+        handlers), and stops the event loop it runs on either way.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.shutdown_telegram_bot(), BOT_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"Telegram bot didn't stop within {BOT_STOP_TIMEOUT} seconds, stopping it regardless")
+        except Exception:
+            log.exception("Error while stopping the Telegram bot")
+        finally:
+            try:
+                # whatever the graceful shutdown didn't get to
+                await self.release_telegram_resources(outbox_timeout=0)
+                self.event_manager.emit(DelugramPollingStatusChangedEvent())
+            finally:
+                loop.call_soon(loop.stop)
+
+    async def shutdown_telegram_bot(self):
+        if self.webhook:
+            await self.webhook.stop()
+            self.webhook = None
+
+        if self.metrics_listener:
+            await self.metrics_listener.stop()
+            self.metrics_listener = None
+
         if self.telegram:
+            if self.telegram.updater.running:
+                await self.telegram.updater.stop()
             await self.telegram.stop()  # Stop PTB gracefully
 
-        self.event_manager.emit(DelugramPollingStatusChangedEvent())
+        for task in list(self.background_tasks):
+            task.cancel()
+        self.prefetcher = None
 
-        # Stop the event loop safely
-        if self.loop.is_running():
-            self.loop.call_soon_threadsafe(self.loop.stop)  # Stop the loop from the main thread
+        if self.dashboard:
+            await self.dashboard.stop()
+            self.dashboard = None
 
-        self.telegram = None
+        if self.digest:
+            self.digest.flush_all()
+            self.digest = None
+
+        await self.release_telegram_resources(outbox_timeout=OUTBOX_STOP_TIMEOUT)
+
+    async def release_telegram_resources(self, outbox_timeout):
+        """Stops the outbox (giving queued messages outbox_timeout seconds), the http client and the watchdog"""
+        if self.outbox:
+            await self.outbox.stop(timeout=outbox_timeout)
+            self.outbox = None
+
+        if self.fetcher:
+            await self.fetcher.close()
+            self.fetcher = None
+
+        if self.watchdog:
+            await self.watchdog.stop()
+            self.watchdog = None
 
     def start_telegram_polling(self):
         if not self.telegram:
             raise RuntimeError("Telegram bot not initialized. Please call initialize_telegram_bot() first")
 
-        if self.telegram.updater.running:
-            log.warning("Telegram bot already polling. continuing...")
+        if self.is_receiving_updates():
+            log.warning("Telegram bot already receiving updates. continuing...")
             return
 
         # start polling
@@ -473,15 +954,38 @@ class Core(CorePluginBase):
         log.debug("Polling started")
 
     def stop_telegram_polling(self):
+        """
+        Stops the bot and its event loop thread. Returns a Deferred firing once the thread has exited.
+        Waiting for it happens off the reactor thread: the bot's handlers may be waiting on the reactor.
+        """
         log.debug("Stopping Telegram bot polling...")
 
-        if self.loop:
-            asyncio.run_coroutine_threadsafe(self.stop_telegram_bot(), self.loop)  # Run stop_bot() safely in the loop
+        loop, thread = self.loop, self.thread
+        if loop and loop.is_running():
+            # stop_telegram_bot() stops the loop once done, or once BOT_STOP_TIMEOUT runs out
+            asyncio.run_coroutine_threadsafe(self.stop_telegram_bot(), loop)
 
-        if self.thread:
-            self.thread.join(timeout=5)  # Wait up to 5 seconds for thread to stop
+        if thread is None:
+            self.reset_telegram_vars()
+            return defer.succeed(None)
 
-        self.reset_telegram_vars()
+        exited = threads.deferToThread(self.join_telegram_thread, thread)
+        return exited.addCallback(self._on_telegram_thread_joined, thread)
+
+    def join_telegram_thread(self, thread):
+        """Waits for the event loop thread to exit, returns whether it did"""
+        thread.join(timeout=BOT_STOP_TIMEOUT + LOOP_THREAD_JOIN_TIMEOUT)
+        return not thread.is_alive()
+
+    def _on_telegram_thread_joined(self, exited, thread):
+        if not exited:
+            # keeping the references makes the bot count as running, so it isn't started a second time
+            # on the same token next to the one that is still there
+            log.error("Telegram bot event loop thread didn't exit, it is left running")
+            return
+
+        if self.thread is thread:
+            self.reset_telegram_vars()
 
         log.debug("Telegram bot polling stopped.")
 
@@ -492,11 +996,43 @@ class Core(CorePluginBase):
         self.loop.run_until_complete(self.start_telegram_bot())  # Run the bot inside this loop
         self.loop.run_forever()  # Keep the loop running
 
+    def is_receiving_updates(self):
+        if not self.telegram:
+            return False
+        if self.webhook:
+            return self.webhook.running
+        return self.telegram.updater.running
+
     def reset_telegram_vars(self):
         self.loop = None
         self.thread = None
         self.telegram = None
 
+    def notify_torrent_event(self, chat_id, kind, torrent_name):
+        """
+        Queues an added/finished notification for chat_id, to be merged with other notifications
+        for the chat arriving within its digest window. Safe to call from deluge event handlers.
+        """
+        if self.digest and self.loop and self.loop.is_running():
+            self.digest.add_threadsafe(chat_id, kind, torrent_name, self.get_digest_window(chat_id))
+        else:
+            log.error("No running event loop available to send Telegram message!")
+
+    async def send_message(self, chat_id, text, priority=None, **kwargs):
+        """Sends a message through the outbox, so it is subject to the same rate limits as everything else."""
+        if priority is None:
+            priority = PRIORITY_REPLY
+        if not self.outbox:
+            return await self.telegram.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        return await self.outbox.call('send_message', chat_id, priority=priority, text=text, **kwargs)
+
+    async def reply(self, update: Update, text, **kwargs):
+        """Replies to the chat the update came from, in the same topic for forum chats."""
+        message = update.effective_message
+        if message and message.is_topic_message:
+            kwargs.setdefault('message_thread_id', message.message_thread_id)
+        return await self.send_message(update.effective_chat.id, text, **kwargs)
+
     #########
     #  Section: Telegram Commands
     #########
@@ -505,16 +1041,14 @@ class Core(CorePluginBase):
         help_msg = [
             f"/{cmd['name']} - {cmd['description']}" for cmd in self.commands if cmd['list_in_help']
         ]
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text='\n'.join(help_msg),
             parse_mode='Markdown',
             # reply_to_message_id=update.message.message_id
         )
 
     async def status_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # clean up existing torrents (if removed or any other reason)
-        self.cleanup_chat_torrents()
-
         #get first arg from the command as page number, default to 1
         try:
             page = int(context.args[0] if context.args and len(context.args) else 1)
@@ -525,23 +1059,17 @@ class Core(CorePluginBase):
 
         log.debug(f"Page: {page}")
 
-        chat_torrents = self.config['chat_torrents'].get(str(update.effective_chat.id), [])
-        message = self.list_torrents(lambda t:
-                               t.get_status(('state',))['state'] in
-                               ('Active', 'Downloading', 'Seeding',
-                                'Paused', 'Checking', 'Error', 'Queued'
-                                ) and str(t.torrent_id) in chat_torrents, page=page)
+        message, reply_markup = await self.show_listing(update.effective_chat.id, context, 'status', page)
 
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=message,
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            reply_markup=reply_markup
             # reply_to_message_id=update.message.message_id
         )
 
     async def ongoing_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # clean up existing torrents (if removed or any other reason)
-        self.cleanup_chat_torrents()
-
         #get first arg from the command as page number, default to 1
         try:
             page = int(context.args[0] if context.args and len(context.args) else 1)
@@ -552,21 +1080,57 @@ class Core(CorePluginBase):
 
         log.debug(f"Page: {page}")
 
-        chat_torrents = self.config['chat_torrents'].get(str(update.effective_chat.id), [])
-        message = self.list_torrents(lambda t:
-                                     t.get_status(('state',))['state'] in
-                                     ('Downloading', 'Queued')
-                                     and str(t.torrent_id) in chat_torrents, page=page)
+        message, reply_markup = await self.show_listing(update.effective_chat.id, context, 'ongoing', page)
 
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=message,
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            reply_markup=reply_markup
             # reply_to_message_id=update.message.message_id
         )
 
+    async def page_callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handles the prev/next buttons of /status and /ongoing by editing the listing in place"""
+        query = update.callback_query
+        await query.answer()
+
+        try:
+            _, kind, page = query.data.split(':')
+            page = int(page)
+        except ValueError:
+            return
+        if kind not in LISTINGS:
+            return
+
+        message, reply_markup = await self.show_listing(update.effective_chat.id, context, kind, page, fresh=False)
+        try:
+            await self.outbox.call('edit_message_text', update.effective_chat.id,
+                                   message_id=query.message.message_id, text=message,
+                                   parse_mode='Markdown', reply_markup=reply_markup)
+        except BadRequest as e:
+            # pressing a button twice before the first edit arrives
+            if 'not modified' not in str(e).lower():
+                raise
+
+    async def watch_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = str(update.effective_chat.id)
+        message = (await self.render_watched_chats([chat_id]))[chat_id]
+        if message is None:
+            await self.reply(update, text="No ongoing torrents to watch")
+            return
+
+        sent = await self.reply(update, text=message, parse_mode='Markdown')
+        self.dashboard.watch(chat_id, sent.message_id, message)
+
+    async def unwatch_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await self.dashboard.unwatch(str(update.effective_chat.id)):
+            await self.reply(update, text="Not watching anything")
+
     async def cancel_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.chat_data.pop('label', None)
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text='Operation cancelled',
             parse_mode='Markdown',
             reply_markup=ReplyKeyboardRemove()
@@ -581,23 +1145,27 @@ class Core(CorePluginBase):
         args = update.message.text.split(sep=' ', maxsplit=3)
 
         if len(args) != 4:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Invalid arguments. Usage: /register <bot_token> <chat_id> <chat_name>"
             )
             return
 
         if args[1] != self.config['telegram_token']:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Invalid bot token. Usage: /register <bot_token> <chat_id> <chat_name>"
             )
             return
 
-        if self.add_chat(chat_id=args[2], name=args[3]):
-            await update.message.reply_text(
+        if await self.run_in_reactor(self.add_chat, chat_id=args[2], name=args[3]):
+            await self.reply(
+                update,
                 text="Chat registered successfully\nChat ID: %s\nChat Name: %s" % (args[2], args[3])
             )
         else:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Chat ID already registered"
             )
 
@@ -608,29 +1176,34 @@ class Core(CorePluginBase):
         args = update.message.text.split(sep=' ', maxsplit=2)
 
         if len(args) != 3:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Invalid arguments. Usage: /deregister <bot_token> <chat_id>"
             )
             return
 
         if args[1] != self.config['telegram_token']:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Invalid bot token. Usage: /deregister <bot_token> <chat_id>"
             )
             return
 
-        if self.remove_chat(chat_id=args[2]):
-            await update.message.reply_text(
+        if await self.run_in_reactor(self.remove_chat, chat_id=args[2]):
+            await self.reply(
+                update,
                 text="Chat deregistered successfully\nChat ID: %s" % (args[2])
             )
         else:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Something went wrong"
             )
 
     async def done_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.chat_data.pop('label', None)
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text='Finished adding torrents.',
             parse_mode='Markdown',
             reply_markup=ReplyKeyboardRemove()
@@ -639,8 +1212,8 @@ class Core(CorePluginBase):
         return ConversationHandler.END
 
     async def add_command_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        # refresh available labels list
-        self.load_available_labels()
+        # refresh available labels list, if the cached one is stale. the label plugin lives on the reactor
+        await self.run_in_reactor(self.load_available_labels)
 
         if len(self.available_labels):
             return await self.advance_to_set_label_state(update=update, context=context)
@@ -653,7 +1226,8 @@ class Core(CorePluginBase):
         session_msg = context.chat_data.pop('message', '')
         keyboard_options = [[g] for g in self.available_labels]
 
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=(f"{session_msg}\n\n" if session_msg else "") + "Select a label",
             reply_markup=ReplyKeyboardMarkup(keyboard_options, one_time_keyboard=True)
             # reply_to_message_id=update.message.message_id
@@ -661,8 +1235,9 @@ class Core(CorePluginBase):
         return SET_LABEL_STATE
 
     async def set_label_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if update.message.text in self.available_labels:
-            context.chat_data['label'] = update.message.text
+        label = await self.run_in_reactor(self.find_label, update.message.text)
+        if label is not None:
+            context.chat_data['label'] = label
 
             return await self.advance_to_torrent_type_state(update=update, context=context)
         else:
@@ -673,7 +1248,8 @@ class Core(CorePluginBase):
         session_msg = context.chat_data.pop('message', '')
         keyboard_options = [['Magnet'], ['.torrent'], ['URL']]
 
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=(f"{session_msg}\n\n" if session_msg else "") + "Select type of torrent source",
             reply_markup=ReplyKeyboardMarkup(keyboard_options, one_time_keyboard=True),
             # reply_to_message_id=update.message.message_id
@@ -685,7 +1261,8 @@ class Core(CorePluginBase):
 
     async def advance_to_add_magnet_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         session_msg = context.chat_data.pop('message', '')
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=(f"{session_msg}\n\n" if session_msg else "") + "Send the magnet link",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -696,7 +1273,8 @@ class Core(CorePluginBase):
 
     async def advance_to_add_torrent_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         session_msg = context.chat_data.pop('message', '')
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=(f"{session_msg}\n\n" if session_msg else "") + "Send the torrent file",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -707,7 +1285,8 @@ class Core(CorePluginBase):
 
     async def advance_to_add_url_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         session_msg = context.chat_data.pop('message', '')
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text=(f"{session_msg}\n\n" if session_msg else "") + "Send the torrent url",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -718,7 +1297,14 @@ class Core(CorePluginBase):
         return await self.advance_to_torrent_type_state(update=update, context=context)
 
     async def add_magnet_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not is_magnet(update.message.text):
+        return await self.ingest_magnets(update, context, message_link_text(update.message))
+
+    async def add_magnet_document_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.ingest_magnets(update, context, await self.read_text_document(update))
+
+    async def ingest_magnets(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+        magnets = extract_links(text, MAGNET_PATTERN, is_magnet, key=lambda m: magnet_info_hash(m) or m)
+        if len(magnets) == 0:
             context.chat_data['message'] = "Invalid magnet link. Try again"
             return await self.advance_to_add_magnet_state(update=update, context=context)
 
@@ -744,41 +1330,27 @@ class Core(CorePluginBase):
             together.
             """
             # since fetching metadata takes some time, lets give a response to user first
-            await update.message.reply_text(
-                text="Fetching metadata for magnet link. Please wait...",
+            await self.reply(
+                update,
+                text="Fetching metadata for magnet link. Please wait..." if len(magnets) == 1
+                else "Fetching metadata for %s magnet links. Please wait..." % len(magnets),
                 reply_markup=ReplyKeyboardRemove()
             )
 
-            async def add_magnet():
-                log.info(f"Adding magnet link")
-                info_hash, encoded_metadata = await self.core.prefetch_magnet_metadata(update.message.text).asFuture(
-                    asyncio.get_event_loop())
-                metadata = bdecode(b64decode(encoded_metadata))
-                torrent_info = TorrentInfo.from_metadata(metadata)
-                file_priorities = [4] * len(torrent_info.files)  # Set all files to normal priority
-
-                tid = self.core.add_torrent_magnet(uri=update.message.text, options={
-                    'delugram_chat_id': update.effective_chat.id,
-                    'file_priorities': file_priorities,
-                })
-                self.apply_label(tid=tid, context=context)
-
-            # since fetching metadata takes a few seconds, we don't want to block the main thread so,
-            # run the add_magnet in the event loop, if available, else run it in the main thread
-            if self.loop and self.loop.is_running():
-                asyncio.run_coroutine_threadsafe(
-                    add_magnet(),
-                    self.loop
-                )
-            else:
-                log.error("No running event loop available to add magnet torrent. falling back to blocking call")
-                await add_magnet()
+            # since fetching metadata takes a few seconds, we don't want to block the conversation, so
+            # add the magnets in the background. the outcome is reported to the chat when they are done
+            self.spawn(self.add_magnets(magnets, update.effective_chat.id, context.chat_data.get('label', None)))
 
-            await update.message.reply_text("Magnet added. Send another magnet or /done to finish.")
+            if len(magnets) == 1:
+                await self.reply(update, "Magnet added. Send another magnet or /done to finish.")
+            else:
+                await self.reply(update, "Adding %s magnets, a summary will follow. Send more magnets or /done to "
+                                         "finish." % len(magnets))
             return ADD_MAGNET_STATE
 
         except Exception as e:
-            await update.message.reply_text(
+            await self.reply(
+                update,
                 text="Failed to add magnet link. Terminating operation\nerror: %s" % str(e),
                 reply_markup=ReplyKeyboardRemove()
             )
@@ -788,91 +1360,98 @@ class Core(CorePluginBase):
         return ConversationHandler.END
 
     async def add_torrent_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if update.message.document.mime_type != 'application/x-bittorrent':
+        # this handler blocks the conversation, so it only collects documents. downloading and adding them
+        # happens in the background, otherwise the rest of an album would arrive while the conversation is
+        # still busy with its first file, and be dropped
+        label = context.chat_data.get('label', None)
+
+        # albums of .torrent files arrive as one update per file, collect them and add them together
+        if update.message.media_group_id:
+            key = (update.effective_chat.id, update.message.media_group_id)
+            if key not in self.media_groups:
+                self.media_groups[key] = []
+                self.spawn(self.add_media_group(key, update, label))
+            self.media_groups[key].append(update.message.document)
+            return ADD_TORRENT_STATE
+
+        if not is_torrent_document(update.message.document):
             context.chat_data['message'] = "Invalid torrent file. Try again"
             return await self.advance_to_add_torrent_state(update=update, context=context)
 
-        try:
-            # Grab file & add torrent with label
-            file_info = await self.telegram.bot.getFile(update.message.document.file_id)
-            request = urllib.request.Request(file_info.file_path, headers=HEADERS)
-            status_code = urllib.request.urlopen(request).getcode()
-            if status_code == 200:
-                file_contents = urllib.request.urlopen(request).read()
-                tid = self.core.add_torrent_file(None, b64encode(file_contents),
-                                                 {'delugram_chat_id': update.effective_chat.id})
-                self.apply_label(tid, context)
-                await update.message.reply_text("Torrent file added. Send another file or /done to finish.")
-                return ADD_TORRENT_STATE
+        self.spawn(self.add_torrent_document(update, label))
+        return ADD_TORRENT_STATE
 
-            else:
-                await update.message.reply_text(
-                    text="Failed to download torrent file. Terminating operation",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-        except Exception as e:
-            await update.message.reply_text(
-                text="Failed to download torrent file. Terminating operation\nerror: %s" % str(e),
-                reply_markup=ReplyKeyboardRemove()
-            )
-            log.error(str(e) + '\n' + traceback.format_exc())
+    async def add_url_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.ingest_urls(update, context, message_link_text(update.message))
 
-        context.chat_data.pop('label', None)
-        return ConversationHandler.END
+    async def add_url_document_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.ingest_urls(update, context, await self.read_text_document(update))
 
-    async def add_url_state_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not is_url(update.message.text):
+    async def ingest_urls(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+        urls = extract_links(text, URL_PATTERN, is_url)
+        if len(urls) == 0:
             context.chat_data['message'] = "Invalid URL. Try again"
             return await self.advance_to_add_url_state(update=update, context=context)
 
-        try:
-            # Grab url & add torrent with label
-            request = urllib.request.Request(update.message.text.strip(), headers=HEADERS)
-            status_code = urllib.request.urlopen(request).getcode()
-            if status_code == 200:
-                file_contents = urllib.request.urlopen(request).read()
-                tid = self.core.add_torrent_file(None, b64encode(file_contents),
-                                                 {'delugram_chat_id': update.effective_chat.id})
-                self.apply_label(tid, context)
-                await update.message.reply_text("Torrent from URL added. Send another URL or /done to finish.")
-                return ADD_URL_STATE
-
-            else:
-                await update.message.reply_text(
-                    text="Failed to download torrent file. Terminating operation",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-        except Exception as e:
-            await update.message.reply_text(
-                text="Failed to download torrent file. Terminating operation\nerror: %s" % str(e),
-                reply_markup=ReplyKeyboardRemove()
-            )
-            log.error(str(e) + '\n' + traceback.format_exc())
-
-        context.chat_data.pop('label', None)
-        return ConversationHandler.END
+        # url downloads run in the background, so a slow site neither stalls updates from other chats nor
+        # keeps the conversation from taking more urls, /done or /cancel meanwhile
+        self.spawn(self.add_urls(urls, update, context.chat_data.get('label', None)))
+        return ADD_URL_STATE
 
     async def invalid_input_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
+        await self.reply(
+            update,
             text="Invalid input. Terminating operation",
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
 
     async def tg_middleware(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not self.chat_is_permitted(update.effective_chat.id):
-            log.warning(f"Unauthorized chat: {update.effective_chat.id}")
-            if update.message and update.message.text and update.message.text == '/start':
-                await update.message.reply_text(text="Unauthorized\nChat ID: %s" % update.effective_chat.id)
+        # updates that don't belong to a chat (e.g. inline queries) aren't handled by delugram
+        if update.effective_chat is None:
+            raise ApplicationHandlerStop("No chat")
+
+        chat_id = update.effective_chat.id
+        if self.chat_is_permitted(chat_id):
+            return
 
+        # chats spamming the bot get their updates dropped without logging or answering every one of them
+        now = time.monotonic()
+        if now - self.rejected_chats.get(chat_id, -REJECTION_INTERVAL) < REJECTION_INTERVAL:
             raise ApplicationHandlerStop("Unauthorized chat")
 
+        if len(self.rejected_chats) > 10000:
+            self.rejected_chats = {k: t for k, t in self.rejected_chats.items() if now - t < REJECTION_INTERVAL}
+        self.rejected_chats[chat_id] = now
+
+        log.warning(f"Unauthorized chat: {chat_id}")
+        if update.message and update.message.text and update.message.text == '/start':
+            await self.reply(update, text="Unauthorized\nChat ID: %s" % chat_id)
+
+        raise ApplicationHandlerStop("Unauthorized chat")
+
     #########
     #  Section: Helpers
     #########
 
-    def load_available_labels(self):
+    def save_config(self):
+        """
+        Schedules a write of delugram.conf. Writes are coalesced, so bursts of changes (e.g. hundreds of
+        torrents added by an RSS feed) end up as a single write.
+        """
+        self.config_writer.mark_dirty()
+
+    def load_available_labels(self, force=False):
+        """
+        Returns the labels of the label plugin. They are cached for LABEL_CACHE_TTL seconds, or until
+        the label plugin is enabled or disabled, so bulk adds don't query the plugin for every torrent.
+        """
+        if not force and self.labels_loaded_at is not None and \
+                time.monotonic() - self.labels_loaded_at < LABEL_CACHE_TTL:
+            return self.available_labels
+
         self.available_labels = []
+        self.label_plugin = None
         try:
             self.label_plugin = component.get('CorePlugin.Label')
 
@@ -885,14 +1464,21 @@ class Core(CorePluginBase):
         except Exception as e:
             log.error("Label plugin not found. Delugram will continue without labels")
 
+        self.label_lookup = {g.lower(): g for g in self.available_labels}
+        self.labels_loaded_at = time.monotonic()
         return self.available_labels
 
-    def apply_label(self, tid, context: ContextTypes.DEFAULT_TYPE):
+    def find_label(self, label):
+        """Returns the available label matching label (case insensitive), or None"""
+        self.load_available_labels()
+        return self.label_lookup.get(label.lower(), None) if label else None
+
+    def apply_label(self, tid, label):
+        """Sets the label of torrent tid, if label is available. Must be called on the reactor thread."""
         try:
-            self.load_available_labels()
-            label = context.chat_data.get('label', None)
+            label = self.find_label(label)
 
-            if label is not None and label != "No Label" and self.label_plugin and label in self.available_labels:
+            if label is not None and label != "No Label" and self.label_plugin:
                 self.label_plugin.set_torrent(tid, label.lower())
                 return True
             return False
@@ -900,77 +1486,446 @@ class Core(CorePluginBase):
             log.error(str(e) + '\n' + traceback.format_exc())
             return False
 
+    def spawn(self, coroutine):
+        """Runs coroutine as a background task on the bot loop, keeping a reference until it is done."""
+        task = self.loop.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def add_magnet(self, magnet, chat_id, label):
+        """Adds a magnet once its metadata has been fetched (see ingest_magnets for why). Returns the torrent id."""
+        log.info(f"Adding magnet link")
+        file_count = await self.prefetcher.file_count(magnet)
+        file_priorities = [4] * file_count  # Set all files to normal priority
+
+        tid = await self.run_in_reactor(self.core.add_torrent_magnet, magnet, {
+            'delugram_chat_id': chat_id,
+            'file_priorities': file_priorities,
+        })
+        await self.run_in_reactor(self.apply_label, tid, label)
+        return tid
+
+    async def add_magnets(self, magnets, chat_id, label):
+        """Adds magnets in the background, reporting failures (or a summary for many magnets) to the chat."""
+        outcomes = await self.add_links(self.add_magnet, magnets, chat_id, label)
+
+        # a single magnet is reported by the regular "Torrent added" notification when it succeeds
+        if len(outcomes) == 1:
+            error = outcomes[0][1]
+            if error is not None:
+                await self.send_message(chat_id, text="Failed to add magnet link\nerror: %s" % html.escape(str(error)),
+                                        parse_mode=ParseMode.HTML, priority=PRIORITY_NOTIFICATION)
+            return
+
+        for message in self.summarize_links(outcomes):
+            await self.send_message(chat_id, text=message, parse_mode=ParseMode.HTML, priority=PRIORITY_NOTIFICATION)
+
+    async def add_torrent_document(self, update: Update, label):
+        """Downloads the .torrent document of update and adds it, reporting the outcome to the chat."""
+        document = update.message.document
+        try:
+            # Grab file through the bot's own connection pool & add torrent with label
+            file_contents = await self.download_document(document)
+            tid = await self.run_in_reactor(self.add_torrent_filedump, file_contents,
+                                            document.file_name, update.effective_chat.id)
+            await self.run_in_reactor(self.apply_label, tid, label)
+            await self.reply(update, "Torrent file added. Send another file or /done to finish.")
+
+        except Exception as e:
+            await self.reply(
+                update,
+                text="Failed to add torrent file %s\nerror: %s\n\nSend another file or /done to finish." %
+                     (document.file_name, str(e))
+            )
+            log.error(str(e) + '\n' + traceback.format_exc())
+
+    async def download_document(self, document):
+        """
+        Downloads a document through the bot's own connection pool. Deluge wants the filedump as bytes,
+        BytesIO.getvalue() hands over the buffer it was downloaded into without copying it again.
+        """
+        file = await document.get_file()
+        buffer = io.BytesIO()
+        await file.download_to_memory(buffer)
+        return buffer.getvalue()
+
+    async def add_media_group(self, key, update: Update, label):
+        """
+        Adds the .torrent documents of a media group (album) once all of its updates have arrived:
+        downloads them concurrently, adds them in one batch and sends one consolidated reply.
+        """
+        await asyncio.sleep(MEDIA_GROUP_DELAY)
+        documents = self.media_groups.pop(key, [])
+        chat_id = update.effective_chat.id
+
+        async def download(document):
+            if not is_torrent_document(document):
+                raise ValueError("Invalid torrent file")
+            return await self.download_document(document)
+
+        files = await asyncio.gather(*[download(d) for d in documents], return_exceptions=True)
+
+        outcomes = {}
+        downloaded = []
+        for document, file in zip(documents, files):
+            if isinstance(file, Exception):
+                outcomes[document.file_unique_id] = file
+            else:
+                downloaded.append((document, file))
+
+        if len(downloaded):
+            results = await self.run_in_reactor(self.add_torrent_filedumps,
+                                                [(file, document.file_name) for document, file in downloaded], chat_id)
+            added = []
+            for (document, _), result in zip(downloaded, results):
+                if isinstance(result, Exception):
+                    outcomes[document.file_unique_id] = result
+                else:
+                    added.append(result)
+            await self.run_in_reactor(lambda: [self.apply_label(tid, label) for tid in added])
+
+        summary = [(document.file_name or document.file_unique_id, outcomes.get(document.file_unique_id, None))
+                   for document in documents]
+        for message in self.summarize_links(summary, "Send another file or /done to finish."):
+            await self.reply(update, text=message, parse_mode=ParseMode.HTML)
+
+    async def add_url(self, url, chat_id, label):
+        """Downloads a .torrent from url and adds it. Returns the torrent id."""
+        file_contents = await self.fetcher.fetch(url)
+        tid = await self.run_in_reactor(self.add_torrent_filedump, file_contents, None, chat_id)
+        await self.run_in_reactor(self.apply_label, tid, label)
+        return tid
+
+    async def add_urls(self, urls, update: Update, label):
+        """Downloads and adds torrents from urls, reporting the outcome to the chat the urls came from."""
+        chat_id = update.effective_chat.id
+
+        # many urls in one message are downloaded concurrently and answered with a single summary
+        if len(urls) > 1:
+            outcomes = await self.add_links(self.add_url, urls, chat_id, label)
+            for message in self.summarize_links(outcomes, "Send more URLs or /done to finish."):
+                await self.reply(update, text=message, parse_mode=ParseMode.HTML)
+            return
+
+        try:
+            # Grab url & add torrent with label
+            await self.add_url(urls[0], chat_id, label)
+            await self.reply(update, "Torrent from URL added. Send another URL or /done to finish.")
+
+        except Exception as e:
+            await self.reply(
+                update,
+                text="Failed to download torrent file\nerror: %s\n\nSend another URL or /done to finish." % str(e)
+            )
+            if not isinstance(e, FetchError):
+                log.error(str(e) + '\n' + traceback.format_exc())
+
+    async def add_links(self, add, links, chat_id, label):
+        """Adds links concurrently with add(link, chat_id, label). Returns (link, exception or None) pairs."""
+        results = await asyncio.gather(*[add(link, chat_id, label) for link in links], return_exceptions=True)
+
+        outcomes = []
+        for link, result in zip(links, results):
+            if isinstance(result, Exception):
+                log.error(f"Failed to add {link}: {result}")
+                outcomes.append((link, result))
+            else:
+                outcomes.append((link, None))
+        return outcomes
+
+    @staticmethod
+    def summarize_links(outcomes, footer=None):
+        lines = []
+        for link, error in outcomes:
+            name = html.escape(link_display_name(link))
+            lines.append(f"\n✅ {name}" if error is None else f"\n🚫 {name}: {html.escape(str(error))}")
+        if footer:
+            lines.append(f"\n\n{footer}")
+
+        added = len([1 for _, error in outcomes if error is None])
+        return split_message(f"Added {added} of {len(outcomes)} torrents:", lines)
+
+    async def read_text_document(self, update: Update):
+        """Downloads a text document sent to the bot, e.g. a list of links"""
+        document = update.message.document
+        if document.file_size and document.file_size > MAX_TEXT_DOCUMENT_SIZE:
+            return ''
+
+        file = await document.get_file()
+        return (await file.download_as_bytearray()).decode('utf-8', errors='replace')
+
+    def get_digest_window(self, chat_id):
+        chat = next((item for item in self.config['chats'] if item["chat_id"] == str(chat_id)), None)
+        if chat is not None and chat.get("digest_window", None) is not None:
+            return chat["digest_window"]
+        return self.config['notification_digest_window']
+
+    def add_torrent_filedump(self, filedump, filename, chat_id, save_state=True):
+        """
+        Adds a raw (not base64 encoded) .torrent file to deluge. Going to the torrent manager directly
+        skips the base64 round trip of core.add_torrent_file. Must be called on the reactor thread.
+        """
+        return self.torrent_manager.add(filedump=filedump, filename=filename, save_state=save_state,
+                                        options={'delugram_chat_id': chat_id})
+
+    def add_torrent_filedumps(self, torrents, chat_id):
+        """
+        Adds (filedump, filename) pairs in one go, saving deluge's session state once at the end.
+        Returns the torrent id, or the exception raised while adding it, of every torrent.
+        Must be called on the reactor thread.
+        """
+        results = []
+        for i, (filedump, filename) in enumerate(torrents):
+            try:
+                results.append(self.add_torrent_filedump(filedump, filename, chat_id,
+                                                         save_state=i == len(torrents) - 1))
+            except Exception as e:
+                results.append(e)
+
+        if len(results) and isinstance(results[-1], Exception):
+            # the last add failed, so the state wasn't saved with it
+            self.torrent_manager.save_state()
+        return results
+
     def add_torrent_for_chat(self, chat_id, torrent_id, torrent_name):
         chat_id = str(chat_id)
         torrent_id = str(torrent_id)
 
-        if chat_id not in self.config['chat_torrents']:
-            self.config['chat_torrents'][chat_id] = {}
+        # a torrent already owned by the chat keeps its original name
+        self.store.add(torrent_id, chat_id, torrent_name)
+        self.torrent_chats[torrent_id] = chat_id
+
+    def migrate_chat_torrents(self):
+        """
+        Moves the chat_torrents map older versions kept in delugram.conf into the ownership store.
+        The import is idempotent, so a crash before the config is saved just repeats it.
+        """
+        if 'chat_torrents' not in self.config:
+            return
+
+        imported = self.store.import_chat_torrents(self.config['chat_torrents'] or {})
+        del self.config['chat_torrents']
+        self.config.save()
+        log.info(f"Moved {imported} torrents from delugram.conf to {OWNERSHIP_DB}")
 
-        if torrent_id not in self.config['chat_torrents'][chat_id]:
-            self.config['chat_torrents'][chat_id][torrent_id] = torrent_name
-            self.config.save()
+    def process_pending_removals(self):
+        """
+        Drops torrents collected by _on_torrent_removed from the ownership store, using the reverse index
+        to find their owners. The deletes are committed in one transaction.
+        """
+        removals, self.pending_removals = self.pending_removals, set()
+        self.removal_call = None
+
+        for torrent_id in removals:
+            # torrents of deregistered chats aren't indexed, so the store is cleaned up regardless
+            self.store.remove(torrent_id)
+            chat_id = self.torrent_chats.pop(torrent_id, None)
+            if chat_id:
+                log.info(f"Removing torrent {torrent_id} from chat {chat_id}, Reason: Torrent removed")
+                self.status_pages.invalidate(chat_id)
 
     def cleanup_chat_torrents(self):
         """
-        Removes torrent IDs from chat_torrents mapping if they no longer exist in Deluge.
+        Removes torrents from the ownership store if they no longer exist in Deluge.
         """
         # Get active torrents from Deluge
-        torrents = list(str(t) for t in self.torrent_manager.torrents.keys())
-        if not isinstance(torrents, list):
-            return
+        torrents = set(str(t) for t in self.torrent_manager.torrents.keys())
 
-        log.debug(f"before chat_torrents cleanup: {self.config['chat_torrents']}")
+        removed = 0
+        for torrent_id, chat_id in self.store.owners().items():
+            if torrent_id not in torrents:
+                log.info(f"Removing torrent {torrent_id} from chat {chat_id}, Reason: Torrent not found")
+                self.store.remove(torrent_id)
+                if self.torrent_chats.get(torrent_id) == chat_id:
+                    del self.torrent_chats[torrent_id]
+                removed += 1
 
-        # Iterate over chat_ids and remove any matching torrent_id from the list
-        for chat_id in list(self.config['chat_torrents'].keys()):
-            # partial backward compatibility (resets chat_torrents to dict if it's not)
-            if not isinstance(self.config['chat_torrents'][chat_id], dict):
-                self.config['chat_torrents'][chat_id] = {}
+        if removed:
+            self.status_pages.clear()
 
-            # Iterate over key values inside self.config['chat_torrents'][chat_id] and if key (torrent_id)
-            # is not found in torrents list, remove that key from self.config['chat_torrents'][chat_id]
-            for torrent_id in list(self.config['chat_torrents'][chat_id]):
-                if torrent_id not in torrents:
-                    log.info(f"Removing torrent {torrent_id} from chat {chat_id}, Reason: Torrent not found")
-                    del self.config['chat_torrents'][chat_id][torrent_id]
+    def get_torrent_chat(self, torrent_id):
+        return self.torrent_chats.get(str(torrent_id), None)
 
-        self.config.save()
+    def rebuild_torrent_chat_index(self):
+        """
+        Rebuilds the torrent_id -> chat_id reverse index from the ownership store. Only torrents of registered
+        chats are indexed, so deregistered chats stop receiving notifications for their torrents.
+        """
+        self.torrent_chats = self.store.owners(self.permitted_chats)
 
-        log.debug(f"after chat_torrents cleanup: {self.config['chat_torrents']}")
+        log.debug(f"Indexed {len(self.torrent_chats)} torrents")
 
-    def get_torrent_chat(self, torrent_id):
-        for chat_id in self.config['chat_torrents']:
-            if str(torrent_id) in self.config['chat_torrents'][chat_id]:
-                return chat_id
-        return None
+    def invalidate_torrent_pages(self, torrent_id):
+        """Drops the cached status pages of the chat owning torrent_id"""
+        owner = self.get_torrent_chat(torrent_id)
+        if owner:
+            self.status_pages.invalidate(owner)
 
-    def list_torrents(self, filter_func, page=1):
-        selected_torrents = []
-        all_torrents = list(self.torrent_manager.torrents.values())
+    def index_chat_torrents(self, chat_id):
+        chat_id = str(chat_id)
+        self.status_pages.invalidate(chat_id)
+        for torrent_id in self.store.chat_torrents(chat_id):
+            self.torrent_chats[torrent_id] = chat_id
 
-        # sort torrents by time added and get 10 based on page number
-        skip = (page - 1) * 10
-        take = page * 10
+    def unindex_chat_torrents(self, chat_id):
+        chat_id = str(chat_id)
+        self.status_pages.invalidate(chat_id)
+        for torrent_id in self.store.chat_torrents(chat_id):
+            if self.torrent_chats.get(torrent_id) == chat_id:
+                del self.torrent_chats[torrent_id]
 
-        if skip >= len(all_torrents):
-            return "Not enough torrents to display page %s" % page
+    def run_in_reactor(self, func, *args, **kwargs):
+        """
+        Calls func on the twisted reactor thread (where deluge components live) and returns an asyncio
+        future, bound to the running loop, which resolves with its (possibly deferred) result.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(result):
+            if not future.done():
+                future.set_result(result)
 
-        torrents = sorted(all_torrents,
-                          key=lambda t: t.get_status(('time_added',))['time_added'],
-                          reverse=True)[skip:take]
+        def set_exception(exception):
+            if not future.done():
+                future.set_exception(exception)
 
-        for t in torrents:
-            if filter_func(t):
-                selected_torrents.append(self.format_torrent_info(t))
-        if len(selected_torrents) == 0:
+        def call():
+            defer.maybeDeferred(func, *args, **kwargs).addCallbacks(
+                lambda result: loop.call_soon_threadsafe(set_result, result),
+                lambda failure: loop.call_soon_threadsafe(set_exception, failure.value)
+            )
+
+        reactor.callFromThread(call)
+        return future
+
+    async def fetch_status_snapshot(self, torrent_ids, keys=INFOS):
+        """
+        Fetches the given status keys for all torrent_ids with a single core status query.
+        Torrents that no longer exist in deluge are silently left out of the snapshot.
+        """
+        torrent_ids = list(torrent_ids)
+        if len(torrent_ids) == 0:
+            return StatusSnapshot({}, keys)
+
+        status = await self.run_in_reactor(self.core.get_torrents_status, {'id': torrent_ids}, list(keys))
+        return StatusSnapshot(status, keys)
+
+    async def show_listing(self, chat_id, context: ContextTypes.DEFAULT_TYPE, kind, page, fresh=True):
+        """
+        Renders a page of one of the LISTINGS along with its prev/next buttons. The listing's ordering is
+        kept in chat_data, so its buttons page through it without fetching and sorting the chat's
+        torrents again (unless fresh or the ordering is older than LISTING_TTL).
+        """
+        listings = context.chat_data.setdefault('listings', {})
+        listing = listings.get(kind, None)
+        if fresh or listing is None or time.monotonic() - listing['taken'] > LISTING_TTL:
+            message, order = await self.list_torrents(chat_id, LISTINGS[kind], page)
+            listings[kind] = {'order': order, 'taken': time.monotonic()}
+        else:
+            order = listing['order']
+            message = await self.render_listing_page(order, page)
+
+        pages = math.ceil(len(order) / PAGE_SIZE)
+        buttons = []
+        if 1 < page <= pages:
+            buttons.append(InlineKeyboardButton("◀ Prev", callback_data=f"page:{kind}:{page - 1}"))
+        if 1 <= page < pages:
+            buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"page:{kind}:{page + 1}"))
+        return message, InlineKeyboardMarkup([buttons]) if len(buttons) else None
+
+    async def list_torrents(self, chat_id, states, page=1):
+        """
+        Lists a page of the chat's torrents that are in one of the given states, newest first.
+        Returns the rendered page and the ordered ids of all matching torrents, which can be used to
+        render further pages with render_listing_page(). Only the chat's own torrents are considered,
+        so the cost depends on the size of the chat's library, not the daemon's.
+        Rendered pages are cached for a few seconds, see STATUS_CACHE_TTL.
+        """
+        chat_id = str(chat_id)
+        key = (tuple(states), page)
+        cached = self.status_pages.get(chat_id, key)
+        if cached is None:
+            generation = self.status_pages.generation(chat_id)
+            order = await self.order_torrents(chat_id, states)
+            cached = (await self.render_listing_page(order, page), order)
+            self.status_pages.put(chat_id, key, cached, generation)
+        return cached
+
+    async def order_torrents(self, chat_id, states):
+        """Returns the ids of the chat's torrents in one of the given states, newest first"""
+        chat_torrents = await self.run_in_reactor(self.store.chat_torrents, chat_id)
+        # ordering only needs two columns, the full status is fetched for the page being shown
+        snapshot = await self.fetch_status_snapshot(chat_torrents, keys=ORDER_KEYS)
+        return self.order_snapshot(snapshot, states)
+
+    def order_snapshot(self, snapshot, states, torrent_ids=None):
+        """
+        Returns the ids of the snapshot's torrents (or of torrent_ids among them) that are in one of
+        the given states, newest first. The snapshot needs the ORDER_KEYS.
+        """
+        time_added = snapshot.column('time_added')
+        torrent_ids_column = snapshot.torrent_ids
+        positions = sorted(snapshot.select('state', states, torrent_ids),
+                           key=lambda i: (time_added[i], torrent_ids_column[i]), reverse=True)
+        return tuple(torrent_ids_column[i] for i in positions)
+
+    async def render_listing_page(self, order, page):
+        """Renders a page of the torrents in order (as returned by order_torrents)"""
+        if len(order) == 0:
             return "No active torrents found"
-        return "\n\n".join(selected_torrents) + f"\n\nPage: {page} of {math.ceil(len(all_torrents) / 10)}"
 
-    def format_torrent_info(self, torrent):
-        try:
-            status = torrent.get_status(INFOS)
+        pages = math.ceil(len(order) / PAGE_SIZE)
+        # the page of a button's callback data can be anything, clients are free to send their own
+        if not 1 <= page <= pages:
+            return "Not enough torrents to display page %s" % page
+
+        page_ids = order[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        snapshot, names = await asyncio.gather(self.fetch_status_snapshot(page_ids),
+                                               self.run_in_reactor(self.store.names, page_ids))
+        return self.render_torrent_list(snapshot, names, page_ids) + f"\n\nPage: {page} of {pages}"
 
+    async def render_watched_chats(self, chat_ids):
+        """
+        Renders the newest ongoing torrents of every watched chat, or None for chats that have nothing
+        ongoing anymore. The ongoing torrents are picked from a single query for the ORDER_KEYS of the
+        chats' torrents, the full status is only fetched for the ones shown, with a second query.
+        """
+        chat_torrents = {chat_id: [] for chat_id in chat_ids}
+        for torrent_id, chat_id in (await self.run_in_reactor(self.store.owners, chat_ids)).items():
+            chat_torrents[chat_id].append(torrent_id)
+        snapshot = await self.fetch_status_snapshot(
+            {torrent_id for torrents in chat_torrents.values() for torrent_id in torrents}, keys=ORDER_KEYS
+        )
+        orders = {chat_id: self.order_snapshot(snapshot, ONGOING_STATES, torrents)
+                  for chat_id, torrents in chat_torrents.items()}
+
+        shown = [torrent_id for order in orders.values() for torrent_id in order[:PAGE_SIZE]]
+        details, names = await asyncio.gather(self.fetch_status_snapshot(shown),
+                                              self.run_in_reactor(self.store.names, shown))
+        # the dashboard has no buttons to page with, it only tells how many more torrents there are
+        pages = {}
+        for chat_id, order in orders.items():
+            if len(order) == 0:
+                pages[chat_id] = None
+                continue
+            pages[chat_id] = self.render_torrent_list(details, names, order[:PAGE_SIZE])
+            if len(order) > PAGE_SIZE:
+                pages[chat_id] += f"\n\n+{len(order) - PAGE_SIZE} more ongoing"
+        return pages
+
+    def render_torrent_list(self, snapshot, names, torrent_ids):
+        """
+        Renders torrent_ids from a snapshot holding their full status, with the original names of the
+        torrents (see OwnershipStore.names)
+        """
+        # torrents removed since the ordering was taken are left out of the snapshot
+        return "\n\n".join(self.format_torrent_info(snapshot.row(torrent_id), names.get(torrent_id, None))
+                           for torrent_id in torrent_ids if torrent_id in snapshot)
+
+    def format_torrent_info(self, status, name=None):
+        try:
             """
             Check if progress is 100% and status is paused, then set to completed
             (download completed but torrent no longer seeding)
@@ -979,24 +1934,27 @@ class Core(CorePluginBase):
                 status['state'] = 'completed'
 
             """
-            replace status['name'] with original name from chat_torrents
+            replace status['name'] with the original name from the ownership store (passed in as name)
             sometimes when torrent is moved / renamed using filebottool, the name in deluge changes
             to something that might not make a lot of sense (like "season 1") so we store the original
-            name in chat_torrents and use that when listing torrents for the user. (this is important
+            name in the ownership store and use that when listing torrents for the user. (this is important
             since "added" and "finished" messages are sent using the same (original) name
             """
-            # first find the torrent_id in chat_torrents
-            chat_id = self.get_torrent_chat(torrent.torrent_id)
-            if chat_id:
-                status['name'] = self.config['chat_torrents'][chat_id].get(str(torrent.torrent_id), status['name'])
+            status['name'] = name or status['name']
 
             status_string = ''.join([f(status[i], status) for i, f in INFO_DICT if f is not None])
         except Exception as e:
             status_string = ''
         return status_string
 
+    def rebuild_chat_permissions(self):
+        """Rebuilds the set of authorized chat ids, must be called whenever config['chats'] changes"""
+        self.permitted_chats = frozenset(str(item["chat_id"]) for item in self.config['chats'])
+        # a chat that was just added shouldn't stay muted
+        self.rejected_chats = {}
+
     def chat_is_permitted(self, chat_id):
-        return str(chat_id) in [item["chat_id"] for item in self.config['chats']]
+        return str(chat_id) in self.permitted_chats
 
     def register_deluge_event_handlers(self):
         self.event_manager.register_event_handler(
@@ -1008,6 +1966,18 @@ class Core(CorePluginBase):
         self.event_manager.register_event_handler(
             'TorrentFinishedEvent', self._on_torrent_finished
         )
+        self.event_manager.register_event_handler(
+            'TorrentStateChangedEvent', self._on_torrent_state_changed
+        )
+        self.event_manager.register_event_handler(
+            'SessionStartedEvent', self._on_session_started
+        )
+        self.event_manager.register_event_handler(
+            'PluginEnabledEvent', self._on_plugin_changed
+        )
+        self.event_manager.register_event_handler(
+            'PluginDisabledEvent', self._on_plugin_changed
+        )
 
     def deregister_deluge_event_handlers(self):
         self.event_manager.deregister_event_handler(
@@ -1018,4 +1988,35 @@ class Core(CorePluginBase):
         )
         self.event_manager.deregister_event_handler(
             'TorrentFinishedEvent', self._on_torrent_finished
-        )
\ No newline at end of file
+        )
+        self.event_manager.deregister_event_handler(
+            'TorrentStateChangedEvent', self._on_torrent_state_changed
+        )
+        self.event_manager.deregister_event_handler(
+            'SessionStartedEvent', self._on_session_started
+        )
+        self.event_manager.deregister_event_handler(
+            'PluginEnabledEvent', self._on_plugin_changed
+        )
+        self.event_manager.deregister_event_handler(
+            'PluginDisabledEvent', self._on_plugin_changed
+        )
+
+    def register_metrics(self):
+        REGISTRY.gauge('loop_tasks', "Coroutines pending on the bot's event loop",
+                       lambda: len(asyncio.all_tasks(self.loop)) if self.loop else 0)
+        REGISTRY.gauge('background_tasks', "Background jobs (magnet and url adds) in progress",
+                       lambda: len(self.background_tasks))
+        REGISTRY.gauge('outbox_queue_depth', "Messages waiting in the telegram outbox",
+                       lambda: self.outbox.depth if self.outbox else 0)
+        REGISTRY.gauge('outbox_dropped', "Messages dropped because the telegram outbox was full",
+                       lambda: self.outbox.dropped if self.outbox else 0)
+        REGISTRY.gauge('pending_removals', "Torrent removals waiting to be processed",
+                       lambda: len(self.pending_removals))
+        REGISTRY.gauge('indexed_torrents', "Torrents owned by a registered chat",
+                       lambda: len(self.torrent_chats))
+
+    def deregister_metrics(self):
+        for name in ('loop_tasks', 'background_tasks', 'outbox_queue_depth', 'outbox_dropped', 'pending_removals',
+                     'indexed_torrents'):
+            REGISTRY.unregister(name)
@@ -0,0 +1,133 @@
+from __future__ import unicode_literals
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import BadRequest
+
+from delugram.logger import log
+from delugram.outbox import PRIORITY_NOTIFICATION
+
+# seconds between two samples of the watched chats' torrents
+WATCH_INTERVAL = 5
+# watches are stopped after this many seconds, so a forgotten one doesn't keep editing forever
+WATCH_MAX_DURATION = 2 * 60 * 60
+# upper bound of the per-watch back off after failed edits
+WATCH_MAX_BACKOFF = 60
+
+WATCH_STOPPED = {
+    'done': "Nothing left downloading, stopped watching.",
+    'expired': "Stopped watching, send /watch to continue.",
+    'stopped': "Stopped watching.",
+}
+
+
+class Watch(object):
+    def __init__(self, message_id, text):
+        self.message_id = message_id
+        self.text = text
+        self.started = time.monotonic()
+        self.next_edit = 0
+        self.backoff = 0
+
+
+class LiveDashboard(object):
+    """
+    Keeps one message per chat up to date with the chat's ongoing torrents.
+
+    A single sampler task serves all watches: every `interval` seconds it calls `sample(chat_ids)`, a
+    coroutine function returning the rendered text for each chat (None once nothing is left to watch),
+    and edits the messages whose text changed through the outbox. Failed edits back off exponentially
+    per chat, and nothing is edited while telegram's flood control has the outbox paused.
+    The sampler only runs while there is something to watch. Must be used on the outbox's event loop.
+    """
+
+    def __init__(self, outbox, sample, interval=WATCH_INTERVAL, max_duration=WATCH_MAX_DURATION):
+        self.outbox = outbox
+        self.sample = sample
+        self.interval = interval
+        self.max_duration = max_duration
+        self.watches: Dict[Any, Watch] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, chat_id, message_id, text):
+        """Starts refreshing message_id (currently showing text) in chat_id, replacing the chat's previous watch."""
+        self.watches[chat_id] = Watch(message_id, text)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="delugram-dashboard")
+
+    async def unwatch(self, chat_id, reason='stopped'):
+        watch = self.watches.pop(chat_id, None)
+        if watch is None:
+            return False
+
+        await self._edit(chat_id, watch, f"{watch.text}\n\n_{WATCH_STOPPED[reason]}_")
+        return True
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.watches = {}
+
+    async def _run(self):
+        while len(self.watches):
+            await asyncio.sleep(self.interval)
+            try:
+                await self._refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Failed to refresh watched torrents: {e}")
+
+    async def _refresh(self):
+        now = time.monotonic()
+        # telegram asked us to back off, don't add to the pile
+        if self.outbox.resume_at > now:
+            return
+
+        chat_ids = list(self.watches)
+        pages = await self.sample(chat_ids)
+
+        edits = []
+        for chat_id in chat_ids:
+            watch = self.watches.get(chat_id, None)
+            if watch is None:
+                continue
+
+            text = pages.get(chat_id, None)
+            if text is None:
+                edits.append(self.unwatch(chat_id, 'done'))
+            elif now - watch.started > self.max_duration:
+                edits.append(self.unwatch(chat_id, 'expired'))
+            elif text != watch.text and now >= watch.next_edit:
+                edits.append(self._refresh_watch(chat_id, watch, text))
+
+        await asyncio.gather(*edits)
+
+    async def _refresh_watch(self, chat_id, watch, text):
+        if await self._edit(chat_id, watch, text):
+            watch.text = text
+            watch.backoff = 0
+        elif self.watches.get(chat_id, None) is watch:
+            watch.backoff = min(WATCH_MAX_BACKOFF, max(self.interval, watch.backoff * 2))
+            watch.next_edit = time.monotonic() + watch.backoff
+
+    async def _edit(self, chat_id, watch, text):
+        try:
+            await self.outbox.call('edit_message_text', chat_id, priority=PRIORITY_NOTIFICATION,
+                                   message_id=watch.message_id, text=text, parse_mode='Markdown')
+            return True
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return True
+            # the message was deleted, or can't be edited anymore
+            log.warning(f"Stopped watching in {chat_id}: {e}")
+            if self.watches.get(chat_id, None) is watch:
+                del self.watches[chat_id]
+            return False
+        except Exception as e:
+            log.warning(f"Failed to refresh watched torrents in {chat_id}: {e}")
+            return False
@@ -99,6 +99,56 @@ Deluge.ux.preferences.DelugramPage = Ext.extend(Ext.Panel, {
                     name: 'admin_chat_id',
                     width: 225,
                 },
+                {
+                    xtype: 'checkbox',
+                    fieldLabel: _('Use Webhook'),
+                    boxLabel: _('Receive updates with a webhook instead of polling'),
+                    name: 'use_webhook',
+                },
+                {
+                    xtype: 'textfield',
+                    fieldLabel: _('Listen Address'),
+                    name: 'webhook_listen',
+                    width: 225,
+                },
+                {
+                    xtype: 'numberfield',
+                    fieldLabel: _('Listen Port'),
+                    name: 'webhook_port',
+                    allowBlank: false,
+                    allowDecimals: false,
+                    minValue: 1,
+                    maxValue: 65535,
+                    width: 225,
+                },
+                {
+                    xtype: 'textfield',
+                    fieldLabel: _('Webhook Path'),
+                    name: 'webhook_path',
+                    width: 225,
+                },
+                {
+                    xtype: 'textfield',
+                    fieldLabel: _('Webhook URL'),
+                    name: 'webhook_url',
+                    width: 225,
+                },
+                {
+                    xtype: 'textfield',
+                    fieldLabel: _('Secret Token'),
+                    name: 'webhook_secret',
+                    width: 225,
+                },
+                {
+                    xtype: 'numberfield',
+                    fieldLabel: _('Metrics Port'),
+                    name: 'metrics_port',
+                    allowBlank: false,
+                    allowDecimals: false,
+                    minValue: 0,
+                    maxValue: 65535,
+                    width: 225,
+                },
                 {
                     xtype: 'button',
                     text: _('Save'),
@@ -159,9 +209,82 @@ Deluge.ux.preferences.DelugramPage = Ext.extend(Ext.Panel, {
             },
         });
 
+        this.metric_list = new Ext.list.ListView({
+            store: new Ext.data.ArrayStore({
+                fields: [
+                    'name',
+                    'labels',
+                    'value'
+                ],
+            }),
+            columns: [
+                {
+                    id: 'name',
+                    width: 0.3,
+                    header: _('Metric'),
+                    sortable: true,
+                    dataIndex: 'name',
+                },
+                {
+                    id: 'labels',
+                    width: 0.3,
+                    header: _('Labels'),
+                    sortable: true,
+                    dataIndex: 'labels',
+                },
+                {
+                    id: 'value',
+                    header: _('Value'),
+                    dataIndex: 'value',
+                },
+            ],
+            singleSelect: true,
+            emptyText: 'No metrics yet',
+        });
+
+        this.metrics_panel = this.add({
+            title: _('Metrics'),
+            items: [
+                this.metric_list,
+            ],
+            bbar: {
+                items: [
+                    {
+                        text: _('Refresh'),
+                        iconCls: 'icon-refresh',
+                        handler: this.reloadMetrics,
+                        scope: this,
+                    },
+                ],
+            },
+        });
+
         this.on('show', this.onPreferencesShow, this);
     },
 
+    reloadMetrics: function () {
+        deluge.client.delugram.get_metrics({
+            success: function (metrics) {
+                var rows = [];
+                Object.keys(metrics).sort().forEach(function (name) {
+                    var metric = metrics[name];
+                    metric.samples.forEach(function (sample) {
+                        var labels = Object.keys(sample.labels).sort().map(function (key) {
+                            return key + '=' + sample.labels[key];
+                        }).join(', ');
+                        var value = metric.type == 'histogram'
+                            ? sample.count + ' calls, p50 ' + (sample.p50 * 1000).toFixed(1) +
+                              'ms, p99 ' + (sample.p99 * 1000).toFixed(1) + 'ms'
+                            : String(sample.value);
+                        rows.push([name, labels, value]);
+                    });
+                });
+                this.metric_list.getStore().loadData(rows);
+            },
+            scope: this,
+        });
+    },
+
     reloadConfig: function () {
         deluge.client.delugram.get_config({
             success: function (config) {
@@ -169,6 +292,13 @@ Deluge.ux.preferences.DelugramPage = Ext.extend(Ext.Panel, {
                 this.form.getForm().setValues({
                     telegram_token: config.telegram_token,
                     admin_chat_id: config.admin_chat_id,
+                    use_webhook: config.update_mode == 'webhook',
+                    webhook_listen: config.webhook_listen,
+                    webhook_port: config.webhook_port,
+                    webhook_path: config.webhook_path,
+                    webhook_url: config.webhook_url,
+                    webhook_secret: config.webhook_secret,
+                    metrics_port: config.metrics_port,
                 });
             },
             scope: this,
@@ -176,7 +306,13 @@ Deluge.ux.preferences.DelugramPage = Ext.extend(Ext.Panel, {
     },
 
     onSaveClick: function () {
+        if (!this.form.getForm().isValid()) {
+            Ext.Msg.alert(_('Error'), _('Please correct the highlighted fields'));
+            return;
+        }
         var values = this.form.getForm().getFieldValues();
+        values.update_mode = values.use_webhook ? 'webhook' : 'polling';
+        delete values.use_webhook;
         deluge.client.delugram.set_config(values, {
             success: function () {
                 Ext.Msg.alert(_('Success'), _('Configuration saved'));
@@ -202,6 +338,7 @@ Deluge.ux.preferences.DelugramPage = Ext.extend(Ext.Panel, {
 
     onPreferencesShow: function () {
         this.reloadConfig();
+        this.reloadMetrics();
     },
 
     onRemoveClick: function () {
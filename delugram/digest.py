@@ -0,0 +1,112 @@
+from __future__ import unicode_literals
+
+import asyncio
+import html
+from typing import Any, Dict, List, Tuple
+
+from telegram.constants import ParseMode
+
+from delugram.logger import log
+
+# telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+# sent with ParseMode.HTML, names have to be escaped with escape_name()
+TITLES = {
+    'added': ('Torrent added: <b>%s</b>', 'Torrents added (%s):'),
+    'finished': ('Torrent finished: <b>%s</b>', 'Torrents finished (%s):'),
+}
+DIGEST_LINE = '\n• <b>%s</b>'
+# overlong names are cut to this many characters
+MAX_NAME_LENGTH = 256
+DIGEST_TITLE_ROOM = 40
+
+
+class NotificationDigest(object):
+    """
+    Merges torrent notifications for a chat that arrive within a short window into a single message.
+
+    The first event for a chat opens its window, events arriving before it closes are appended, and the
+    whole batch is then sent as one digest (split over several messages only if it would exceed telegram's
+    message length limit). A window of 0 sends every event on its own, like before digests existed.
+    Must be used on the event loop of the outbox it sends through; `add_threadsafe()` can be called from any thread.
+    """
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+        self.pending: Dict[Any, List[Tuple[str, str]]] = {}
+        self.lengths: Dict[Any, int] = {}
+        self.timers: Dict[Any, asyncio.TimerHandle] = {}
+
+    def add_threadsafe(self, chat_id, kind, name, window):
+        self.outbox.loop.call_soon_threadsafe(self.add, chat_id, kind, name, window)
+
+    def add(self, chat_id, kind, name, window):
+        events = self.pending.setdefault(chat_id, [])
+        events.append((kind, name))
+        self.lengths[chat_id] = self.lengths.get(chat_id, 0) + len(DIGEST_LINE % escape_name(name))
+
+        # no point in waiting for more once the digest is already a full message (leaving room for titles)
+        if window <= 0 or self.lengths[chat_id] >= MAX_MESSAGE_LENGTH - 2 * DIGEST_TITLE_ROOM:
+            self.flush(chat_id)
+        elif chat_id not in self.timers:
+            self.timers[chat_id] = self.outbox.loop.call_later(window, self.flush, chat_id)
+
+    def flush(self, chat_id):
+        timer = self.timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        events = self.pending.pop(chat_id, [])
+        self.lengths.pop(chat_id, None)
+
+        messages = self.render(events)
+        log.debug(f"Sending {len(events)} notifications to {chat_id} in {len(messages)} messages")
+        for message in messages:
+            self.outbox.submit('send_message', chat_id, text=message, parse_mode=ParseMode.HTML)
+
+    def flush_all(self):
+        for chat_id in list(self.pending):
+            self.flush(chat_id)
+
+    @staticmethod
+    def render(events):
+        """Renders events as digest messages, each at most MAX_MESSAGE_LENGTH characters long."""
+        messages = []
+        for kind in TITLES:
+            names = [escape_name(name) for k, name in events if k == kind]
+            if len(names) == 0:
+                continue
+
+            single, title = TITLES[kind]
+            if len(names) == 1:
+                messages.append(single % names[0])
+                continue
+
+            messages.extend(split_message(title % len(names), [DIGEST_LINE % name for name in names]))
+
+        return messages
+
+
+def escape_name(name):
+    """Escapes a torrent name for an html message, cutting it short if it is overlong"""
+    if len(name) > MAX_NAME_LENGTH:
+        name = name[:MAX_NAME_LENGTH] + '…'
+    return html.escape(name)
+
+
+def split_message(title, lines):
+    """
+    Joins title and lines into as few messages as possible, each at most MAX_MESSAGE_LENGTH characters
+    long. Lines are never split (so html entities stay intact), overlong lines are cut short instead.
+    """
+    messages = []
+    message = title
+    for line in lines:
+        if len(message) + len(line) > MAX_MESSAGE_LENGTH and message != title:
+            messages.append(message)
+            message = title + ' (continued)'
+        message += line if len(message) + len(line) <= MAX_MESSAGE_LENGTH else \
+            '\n' + html.escape(html.unescape(line.strip())[:MAX_NAME_LENGTH]) + '…'
+    messages.append(message)
+    return messages
@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+
+import asyncio
+from typing import Dict, List, Optional
+
+import httpx
+
+from delugram.logger import log
+
+
+class FetchError(Exception):
+    def __init__(self, message: str = "Failed to download torrent file"):
+        super().__init__(message)
+
+
+class TorrentFetcher(object):
+    """
+    Downloads .torrent files over a shared, pooled keep-alive HTTP client.
+
+    Each URL is fetched once and streamed into a single buffer that is capped at `max_size` bytes.
+    Concurrent downloads are bounded overall by the connection pool and per host by a semaphore, so a
+    burst of adds against one tracker site doesn't hog the pool. A host's semaphore is dropped once no
+    download uses it. `timeout` applies to each network operation, `deadline` to a whole download, so a
+    server trickling its response can't hold a slot for long. Must be started and closed from the
+    event loop it is used on.
+    """
+
+    def __init__(self, headers=None, max_connections=20, max_connections_per_host=4,
+                 max_size=10 * 1024 * 1024, timeout=30, deadline=120):
+        self.headers = headers or {}
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.max_size = max_size
+        self.timeout = timeout
+        self.deadline = deadline
+
+        self.client: Optional[httpx.AsyncClient] = None
+        # host -> [semaphore, number of downloads using or waiting for it]
+        self._host_slots: Dict[str, List] = {}
+
+    async def start(self):
+        if self.client is not None:
+            return
+
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            follow_redirects=True,
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    async def close(self):
+        if self.client is None:
+            return
+
+        client, self.client = self.client, None
+        self._host_slots = {}
+        await client.aclose()
+
+    async def fetch(self, url) -> bytes:
+        """
+        Downloads url and returns its body. Raises FetchError on non 200 responses, oversized bodies or
+        downloads taking longer than `deadline` seconds.
+        """
+        if self.client is None:
+            raise RuntimeError("TorrentFetcher not started. Please call start() first")
+
+        try:
+            host = httpx.URL(url).host
+        except httpx.InvalidURL as e:
+            raise FetchError("Invalid URL: %s" % e)
+
+        slot = self._host_slots.get(host, None)
+        if slot is None:
+            slot = self._host_slots[host] = [asyncio.Semaphore(self.max_connections_per_host), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                body = await asyncio.wait_for(self._download(url), self.deadline)
+        except asyncio.TimeoutError:
+            raise FetchError("Downloading %s took longer than %s seconds" % (url, self.deadline))
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0 and self._host_slots.get(host, None) is slot:
+                del self._host_slots[host]
+
+        log.debug(f"Fetched {len(body)} bytes from {host}")
+        return body
+
+    async def _download(self, url) -> bytes:
+        try:
+            async with self.client.stream('GET', url) as response:
+                if response.status_code != 200:
+                    raise FetchError("Server responded with HTTP %s" % response.status_code)
+
+                length = response.headers.get('content-length', None)
+                if length and length.isdigit() and int(length) > self.max_size:
+                    raise FetchError("File is larger than %s bytes" % self.max_size)
+
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_size:
+                        raise FetchError("File is larger than %s bytes" % self.max_size)
+
+        except httpx.HTTPError as e:
+            raise FetchError("Failed to download %s: %s" % (url, e))
+
+        return bytes(body)
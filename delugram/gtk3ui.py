@@ -14,6 +14,19 @@ from deluge.ui.gtk3 import dialogs
 from .common import get_resource
 from delugram.logger import log
 
+def format_metric_rows(metrics):
+    """Flattens the result of get_metrics into (name, labels, value) rows for display"""
+    rows = []
+    for name, metric in sorted(metrics.items()):
+        for sample in metric['samples']:
+            labels = ', '.join(f"{key}={value}" for key, value in sorted(sample['labels'].items()))
+            if metric['type'] == 'histogram':
+                value = f"{sample['count']} calls, p50 {sample['p50'] * 1000:.1f}ms, p99 {sample['p99'] * 1000:.1f}ms"
+            else:
+                value = f"{sample['value']:g}"
+            rows.append((name, labels, value))
+    return rows
+
 class ErrorDialog(Gtk.Dialog):
 
     def __init__(self, title, message):
@@ -108,6 +121,24 @@ class Gtk3UI(Gtk3PluginBase):
         self.create_columns(self.treeView)
         sw.add(self.treeView)
         sw.show_all()
+
+        metrics_vbox = self.builder.get_object('metrics_vbox')
+        metrics_sw = Gtk.ScrolledWindow()
+        metrics_sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+        metrics_sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        metrics_sw.set_min_content_height(150)
+        metrics_vbox.pack_start(metrics_sw, True, True, 0)
+        metrics_vbox.reorder_child(metrics_sw, 0)
+
+        self.metrics_store = Gtk.ListStore(str, str, str)
+        metrics_view = Gtk.TreeView(self.metrics_store)
+        for i, title in enumerate(('Metric', 'Labels', 'Value')):
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i)
+            column.set_sort_column_id(i)
+            column.set_resizable(True)
+            metrics_view.append_column(column)
+        metrics_sw.add(metrics_view)
+        metrics_sw.show_all()
         component.get('Preferences').add_page(
             'Delugram', self.builder.get_object('prefs_box')
         )
@@ -171,6 +202,17 @@ class Gtk3UI(Gtk3PluginBase):
         self.builder.get_object('restart_button').set_sensitive(False)
         self.on_apply_prefs(callback=restart)
 
+    def on_metrics_refresh_button_clicked(self, event=None):
+        self.reload_metrics()
+
+    def reload_metrics(self):
+        client.delugram.get_metrics().addCallbacks(self.cb_get_metrics, self.on_error_show)
+
+    def cb_get_metrics(self, metrics):
+        self.metrics_store.clear()
+        for row in format_metric_rows(metrics or {}):
+            self.metrics_store.append(list(row))
+
     def on_listitem_activated(self, treeview):
         tree, tree_id = self.treeView.get_selection().get_selected()
         if tree_id:
@@ -190,13 +232,31 @@ class Gtk3UI(Gtk3PluginBase):
             callback = self.reload_config
             self.builder.get_object('restart_button').set_sensitive(True)
 
+        try:
+            webhook_port = int(self.builder.get_object('input_webhook_port').get_text())
+        except ValueError:
+            webhook_port = self.config.get('webhook_port', 8443)
+
+        try:
+            metrics_port = int(self.builder.get_object('input_metrics_port').get_text() or 0)
+        except ValueError:
+            metrics_port = self.config.get('metrics_port', 0)
+
         client.delugram.set_config({
             'telegram_token': self.builder.get_object('input_telegram_token').get_text(),
             'admin_chat_id': self.builder.get_object('input_admin_chat_id').get_text(),
+            'update_mode': 'webhook' if self.builder.get_object('input_use_webhook').get_active() else 'polling',
+            'webhook_listen': self.builder.get_object('input_webhook_listen').get_text(),
+            'webhook_port': webhook_port,
+            'webhook_path': self.builder.get_object('input_webhook_path').get_text(),
+            'webhook_url': self.builder.get_object('input_webhook_url').get_text(),
+            'webhook_secret': self.builder.get_object('input_webhook_secret').get_text(),
+            'metrics_port': metrics_port,
         }).addCallbacks(callback, self.on_error_show)
 
     def on_show_prefs(self):
         self.reload_config()
+        self.reload_metrics()
 
     def on_polling_status_changed_event(self):
         self.reload_config()
@@ -212,9 +272,16 @@ class Gtk3UI(Gtk3PluginBase):
         # set ui input_telegram_token and input_admin_chat_id
         self.builder.get_object('input_telegram_token').set_text(self.config.get('telegram_token', ''))
         self.builder.get_object('input_admin_chat_id').set_text(self.config.get('admin_chat_id', ''))
+        self.builder.get_object('input_use_webhook').set_active(self.config.get('update_mode', '') == 'webhook')
+        self.builder.get_object('input_webhook_listen').set_text(self.config.get('webhook_listen', ''))
+        self.builder.get_object('input_webhook_port').set_text(str(self.config.get('webhook_port', '')))
+        self.builder.get_object('input_webhook_path').set_text(self.config.get('webhook_path', ''))
+        self.builder.get_object('input_webhook_url').set_text(self.config.get('webhook_url', ''))
+        self.builder.get_object('input_webhook_secret').set_text(self.config.get('webhook_secret', ''))
+        self.builder.get_object('input_metrics_port').set_text(str(self.config.get('metrics_port', 0) or ''))
         self.builder.get_object('polling_status_label').set_text(
             'Running ✓' if self.config.get('polling', False)
-            else 'Stopped ✗ (Double check Telegram Token and Restart Polling)')
+            else 'Stopped ✗ (Double check Telegram Token / Webhook settings and Restart Polling)')
 
         # refresh registered chats list
         self.store.clear()
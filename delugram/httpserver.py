@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+
+import asyncio
+from http import HTTPStatus
+from typing import Dict, Optional
+
+from delugram.logger import log
+
+# requests larger than this are rejected, telegram updates are a few kilobytes at most
+MAX_BODY_SIZE = 1024 * 1024
+# seconds a connection may stay silent (idle between requests, or in the middle of one) before it is closed
+IDLE_TIMEOUT = 60
+
+
+class HttpListener(object):
+    """
+    Minimal asyncio HTTP/1.1 listener, just enough to receive webhook calls on the bot's event loop
+    without pulling in a web framework.
+
+    `handler` is a coroutine function `handler(method, path, headers, body)` returning a
+    `(status, content_type, body)` tuple. Header names are lowercased. Keep-alive is supported,
+    so a reverse proxy can reuse its connections; connections silent for `idle_timeout` seconds are closed.
+    """
+
+    def __init__(self, host, port, handler, name='http', idle_timeout=IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    @property
+    def running(self):
+        return self.server is not None and self.server.is_serving()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        log.info(f"{self.name} listener started on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is None:
+            return
+
+        server, self.server = self.server, None
+        server.close()
+        # idle keep-alive connections would otherwise keep wait_closed() waiting
+        connections = list(self._connections.items())
+        for task, writer in connections:
+            writer.close()
+            task.cancel()
+        await asyncio.gather(*[task for task, _ in connections], return_exceptions=True)
+        await server.wait_closed()
+        log.info(f"{self.name} listener stopped")
+
+    async def _read(self, read):
+        return await asyncio.wait_for(read, self.idle_timeout)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                request_line = await self._read(reader.readline())
+                if not request_line:
+                    break
+
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, 'text/plain', b'', False)
+                    break
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await self._read(reader.readline())
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, 'text/plain', b'', False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'text/plain', b'', False)
+                    break
+                body = await self._read(reader.readexactly(length)) if length else b''
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    status, content_type, response = await self.handler(method, path, headers, body)
+                except Exception as e:
+                    log.error(f"Error while handling {method} {path} on {self.name} listener: {e}")
+                    status, content_type, response = HTTPStatus.INTERNAL_SERVER_ERROR, 'text/plain', b''
+
+                await self._respond(writer, status, content_type, response, keep_alive)
+                if not keep_alive:
+                    break
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # stop() cancels the connections still open, that is how they end and not an error
+            if self.server is not None:
+                raise
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, content_type, body, keep_alive):
+        status = HTTPStatus(status)
+        writer.write(
+            (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+             f"Content-Type: {content_type}\r\n"
+             f"Content-Length: {len(body)}\r\n"
+             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body
+        )
+        await writer.drain()
@@ -0,0 +1,229 @@
+from __future__ import unicode_literals
+
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# upper bounds (seconds) of the latency buckets, from an in-memory handler up to a slow download
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self._values.items()]
+
+
+class Gauge(object):
+    """A value read when the metrics are collected. `read` returns a number, or a dict of labels -> number."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read: Callable[[], Any]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [{'labels': dict(key), 'value': v} for key, v in value.items()]
+        return [{'labels': {}, 'value': value}]
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # per labels: [count per bucket (the last one is +Inf), sum]
+        self._values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key, None)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        samples = []
+        for key, counts, total in values:
+            count = sum(counts)
+            samples.append({
+                'labels': dict(key),
+                'count': count,
+                'sum': total,
+                'buckets': [[bound, sum(counts[:i + 1])] for i, bound in enumerate(self.buckets)],
+                'p50': self._quantile(counts, count, 0.5),
+                'p99': self._quantile(counts, count, 0.99),
+            })
+        return samples
+
+    def _quantile(self, counts, count, q):
+        """Estimates the q quantile by interpolating within its bucket, like prometheus' histogram_quantile"""
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank:
+                if i == len(self.buckets):
+                    # beyond the last bound there is nothing to interpolate against
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / max(bucket_count, 1)
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class Registry(object):
+    """
+    Process wide collection of delugram's metrics. Counters and histograms can be updated from any
+    thread. `collect()` returns plain dicts and lists (as sent over deluge's RPC), `render()` the
+    prometheus text exposition format.
+    """
+
+    def __init__(self, namespace='delugram'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+
+    def _get_or_create(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name, None)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, help) -> Counter:
+        return self._get_or_create(Counter, name, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, buckets)
+
+    def gauge(self, name, help, read) -> Gauge:
+        """Registers a gauge, replacing the one registered under the same name before"""
+        with self._lock:
+            metric = self._metrics[name] = Gauge(name, help, read)
+            return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def collect(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {'type': metric.kind, 'help': metric.help, 'samples': metric.samples()}
+                for metric in metrics}
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for sample in metric['samples']:
+                labels = sample['labels']
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {sample['value']}")
+                    continue
+                for bound, count in sample['buckets']:
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {sample['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {sample['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {sample['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def timed(histogram: Histogram, errors: Optional[Counter] = None, **labels):
+    """
+    Decorator recording the duration of every call of a function or coroutine function in `histogram`,
+    and exceptions it raises in `errors`, labeled with the function's name as `handler`.
+    """
+
+    def decorator(func):
+        labels.setdefault('handler', func.__name__)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+
+    return decorator
+
+
+REGISTRY = Registry()
+
+TELEGRAM_HANDLER_SECONDS = REGISTRY.histogram('telegram_handler_seconds', "Time spent in telegram update handlers")
+TELEGRAM_HANDLER_ERRORS = REGISTRY.counter('telegram_handler_errors_total', "Exceptions raised by telegram handlers")
+DELUGE_EVENT_SECONDS = REGISTRY.histogram('deluge_event_seconds', "Time spent in deluge event handlers")
+DELUGE_EVENT_ERRORS = REGISTRY.counter('deluge_event_errors_total', "Exceptions raised by deluge event handlers")
+BOT_API_SECONDS = REGISTRY.histogram('bot_api_seconds', "Duration of Bot API calls made by the outbox")
+BOT_API_ERRORS = REGISTRY.counter('bot_api_errors_total', "Failed Bot API calls made by the outbox")
+SAVE_SECONDS = REGISTRY.histogram('save_seconds', "Duration of delugram.conf saves and ownership store commits")
+SAVE_ERRORS = REGISTRY.counter('save_errors_total', "Failed delugram.conf saves and ownership store commits")
+LOOP_LAG_SECONDS = REGISTRY.histogram('loop_lag_seconds', "How late the bot's event loop ran its heartbeat")
+LOOP_STALLS = REGISTRY.counter('loop_stalls_total', "Times a handler blocked the bot's event loop")
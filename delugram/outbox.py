@@ -0,0 +1,294 @@
+from __future__ import unicode_literals
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from delugram.logger import log
+from delugram.metrics import BOT_API_ERRORS, BOT_API_SECONDS
+
+# lower value is sent first
+PRIORITY_ADMIN, PRIORITY_REPLY, PRIORITY_NOTIFICATION = range(3)
+
+
+class TokenBucket(object):
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity` tokens."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Takes a token if one is available. Returns 0 on success, otherwise seconds until one will be."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self):
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        wait = self.take()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.take()
+
+
+class Outbox(object):
+    """
+    Single pipeline for everything the bot sends to telegram.
+
+    Calls are queued by priority (admin errors first, then replies, then notifications) and sent by a
+    small pool of workers, each send waiting for both a global and a per-chat token bucket so bursts
+    stay within telegram's limits (~30 messages/s overall, ~1 message/s per chat). Sends rejected with
+    RetryAfter pause the whole outbox for the requested time and are retried, as are network errors.
+
+    A chat gets one call at a time: the others wait behind it and follow in order (by priority, then in
+    the order they were queued), so e.g. the parts of a split message can't overtake each other.
+    At most `max_queue` calls are accepted at a time; beyond that `submit()` drops calls and `call()`
+    waits for room. A call that was accepted is never dropped for lack of room later, also not when it
+    has to wait for its chat's rate limit or for a retry.
+
+    `call()` must be awaited, and `submit()` called, from the outbox's event loop.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_queue=1000, workers=8, max_retries=3):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.workers = workers
+        self.max_retries = max_retries
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        self.resume_at = 0
+        self.dropped = 0
+        # calls accepted and not done yet, wherever they are waiting
+        self.pending = 0
+        # chat id -> sequence number of the call the chat is busy with (being sent, or waiting to be sent again)
+        self.lanes: Dict[Any, int] = {}
+        # chat id -> heap of calls waiting for the chat's current call to be done
+        self.held: Dict[Any, List[Any]] = {}
+        # sequence number -> (timer, call) of calls waiting to be sent again
+        self.deferred: Dict[int, Tuple[asyncio.TimerHandle, Any]] = {}
+
+        self._room: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+
+    @property
+    def running(self):
+        return len(self._tasks) > 0
+
+    @property
+    def depth(self):
+        return self.pending
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        # the queue itself is unbounded, what gets into it is limited by _accept() to max_queue calls
+        self.queue = asyncio.PriorityQueue()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [self.loop.create_task(self._worker(), name=f"delugram-outbox-{i}")
+                       for i in range(self.workers)]
+
+    async def stop(self, timeout=5):
+        """Gives queued messages up to `timeout` seconds to go out, then cancels the workers."""
+        if not self.running:
+            return
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Dropping {self.pending} unsent telegram messages")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # fail whatever is left so nobody awaits forever
+        left = [item for items in self.held.values() for item in items]
+        for timer, item in self.deferred.values():
+            timer.cancel()
+            left.append(item)
+        while not self.queue.empty():
+            left.append(self.queue.get_nowait())
+        for item in left:
+            self._set_exception(item[-2], RuntimeError("Outbox stopped"))
+
+        self.held.clear()
+        self.deferred.clear()
+        self.lanes.clear()
+        self.pending = 0
+
+    async def call(self, method, chat_id, priority=PRIORITY_REPLY, **kwargs):
+        """Queues bot.<method>(chat_id=chat_id, **kwargs) and waits for its result."""
+        future = self.loop.create_future()
+        while self.pending >= self.max_queue:
+            await self._room.wait()
+        self._accept((priority, next(self._sequence), method, chat_id, kwargs, future, 0))
+        return await future
+
+    def submit(self, method, chat_id, priority=PRIORITY_NOTIFICATION, **kwargs):
+        """Queues bot.<method>(chat_id=chat_id, **kwargs) without waiting for it. Must be called on the outbox's loop."""
+        self._put_nowait((priority, next(self._sequence), method, chat_id, kwargs, None, 0))
+
+    def _put_nowait(self, item):
+        if self.pending >= self.max_queue:
+            self.dropped += 1
+            log.warning(f"Telegram outbox full ({self.max_queue} messages), dropping {item[2]} to {item[3]}")
+            self._set_exception(item[-2], RuntimeError("Outbox full"))
+            return
+        self._accept(item)
+
+    def _accept(self, item):
+        self.pending += 1
+        self._idle.clear()
+        if self.pending >= self.max_queue:
+            self._room.clear()
+        self.queue.put_nowait(item)
+
+    def _done(self, item):
+        """Hands item's chat to its next call, and frees item's room in the outbox"""
+        chat_id = item[3]
+        held = self.held.get(chat_id, None)
+        if held:
+            following = heapq.heappop(held)
+            if not held:
+                del self.held[chat_id]
+            self.lanes[chat_id] = following[1]
+            self.queue.put_nowait(following)
+        else:
+            self.lanes.pop(chat_id, None)
+
+        self.pending -= 1
+        if self.pending < self.max_queue:
+            self._room.set()
+        if self.pending == 0:
+            self._idle.set()
+
+    def _defer(self, item, delay):
+        """Sends item again after delay seconds. Its chat stays busy with it meanwhile."""
+        def resume():
+            self.deferred.pop(item[1], None)
+            self.queue.put_nowait(item)
+
+        self.deferred[item[1]] = (self.loop.call_later(delay, resume), item)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id, None)
+        if bucket is None:
+            # forget idle chats once in a while, so the buckets don't grow with every chat ever seen
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.full}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+
+            # the chat is busy with an earlier call, this one follows once that is done
+            if self.lanes.setdefault(item[3], item[1]) != item[1]:
+                heapq.heappush(self.held.setdefault(item[3], []), item)
+                continue
+
+            try:
+                await self._send(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Unexpected error in telegram outbox: {e}")
+            finally:
+                # unless it is waiting to be sent again, the call is done with
+                if item[1] not in self.deferred:
+                    self._done(item)
+
+    async def _send(self, item):
+        priority, sequence, method, chat_id, kwargs, future, attempt = item
+        if future is not None and future.done():
+            return
+
+        # telegram asked us to back off, hold everything until then
+        pause = self.resume_at - time.monotonic()
+        if pause > 0:
+            self._defer(item, pause)
+            return
+
+        # don't let one busy chat tie up a worker, come back to it once its bucket has refilled
+        wait = self._chat_bucket(chat_id).take()
+        if wait > 0:
+            self._defer(item, wait)
+            return
+
+        await self.global_bucket.acquire()
+
+        try:
+            result = await self._call(method, chat_id, kwargs)
+        except RetryAfter as e:
+            retry_after = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+            log.warning(f"Telegram flood control hit on {method} to {chat_id}, retrying in {retry_after}s")
+            self._retry(item, e, retry_after)
+        except BadRequest as e:
+            # BadRequest is a NetworkError too, but retrying it won't help
+            if future is None:
+                log.error(f"Failed to {method} to {chat_id}: {e}")
+            self._set_exception(future, e)
+        except (TimedOut, NetworkError) as e:
+            log.warning(f"Network error on {method} to {chat_id}: {e}")
+            self._retry(item, e, 2 ** attempt)
+        except Exception as e:
+            if future is None:
+                log.error(f"Failed to {method} to {chat_id}: {e}")
+            self._set_exception(future, e)
+        else:
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    async def _call(self, method, chat_id, kwargs):
+        """Makes the Bot API call, recording how long it took and whether it failed"""
+        started = time.perf_counter()
+        try:
+            return await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+        except Exception as e:
+            BOT_API_ERRORS.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            BOT_API_SECONDS.observe(time.perf_counter() - started, method=method)
+
+    def _retry(self, item, exception, delay):
+        priority, sequence, method, chat_id, kwargs, future, attempt = item
+        if attempt >= self.max_retries:
+            if future is None:
+                log.error(f"Giving up on {method} to {chat_id} after {attempt + 1} attempts: {exception}")
+            self._set_exception(future, exception)
+            return
+
+        self._defer((priority, sequence, method, chat_id, kwargs, future, attempt + 1), delay)
+
+    @staticmethod
+    def _set_exception(future, exception):
+        if future is not None and not future.done():
+            future.set_exception(exception)
@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class PageCache(object):
+    """
+    Short lived cache of rendered pages (e.g. /status output), keyed by chat and page.
+
+    Entries expire after `ttl` seconds, and `invalidate(chat_id)` drops all pages of a chat at once by
+    bumping the chat's generation, so torrent events can be handled from the reactor thread without
+    touching the entries the bot loop reads. A page rendered while its chat was invalidated is stored
+    under the old generation and is therefore never served.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: Dict[Tuple[Any, Any], Tuple[float, Tuple[int, int], Any]] = {}
+        self.generations: Dict[Any, int] = {}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, chat_id):
+        return self.epoch, self.generations.get(chat_id, 0)
+
+    def get(self, chat_id, key) -> Optional[Any]:
+        entry = self.entries.get((chat_id, key), None)
+        if entry is not None:
+            created, generation, value = entry
+            if generation == self.generation(chat_id) and time.monotonic() - created < self.ttl:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, chat_id, key, value, generation):
+        """Stores value, `generation` being the chat's generation from before the value was computed."""
+        if len(self.entries) >= self.max_entries:
+            now = time.monotonic()
+            self.entries = {k: e for k, e in self.entries.items() if now - e[0] < self.ttl}
+            if len(self.entries) >= self.max_entries:
+                self.entries = {}
+
+        self.entries[(chat_id, key)] = (time.monotonic(), generation, value)
+
+    def invalidate(self, chat_id):
+        self.generations[chat_id] = self.generations.get(chat_id, 0) + 1
+
+    def clear(self):
+        self.epoch += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
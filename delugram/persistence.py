@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from twisted.internet import reactor
+from twisted.python import threadable
+
+from delugram.logger import log
+from delugram.metrics import SAVE_ERRORS, SAVE_SECONDS
+
+
+class WriteBehind(object):
+    """
+    Coalesces save requests into as few writes as possible.
+
+    `mark_dirty()` only flags the data as changed and (re)arms a timer on the twisted reactor. The save
+    callable runs once the data has been quiet for `delay` seconds, but never later than `max_delay`
+    seconds after the first unsaved change, so a steady stream of changes still gets persisted.
+    Saves always run on the reactor thread, which is where deluge mutates the config from event handlers.
+    A failed save is retried after `max_delay` seconds.
+    """
+
+    def __init__(self, save, delay=2.0, max_delay=30.0, name='config'):
+        self.save = save
+        self.delay = delay
+        self.max_delay = max_delay
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._dirty_since = None
+        self._call = None
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def mark_dirty(self):
+        with self._lock:
+            if not self._dirty:
+                self._dirty = True
+                self._dirty_since = time.monotonic()
+
+        if threadable.isInIOThread():
+            self._schedule()
+        else:
+            reactor.callFromThread(self._schedule)
+
+    def flush(self):
+        """Saves right away if there are unsaved changes. Must be called from the reactor thread."""
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._dirty_since = None
+
+        started = time.perf_counter()
+        try:
+            self.save()
+        except Exception as e:
+            SAVE_ERRORS.inc(target=self.name)
+            log.error(f"Failed to save {self.name}: {e}")
+            with self._lock:
+                if not self._dirty:
+                    self._dirty = True
+                    self._dirty_since = time.monotonic()
+            # retry without waiting for another change, backing off so a lasting failure isn't retried in a loop.
+            # a change made during the save has already scheduled a sooner attempt
+            if self._call is None or not self._call.active():
+                self._call = reactor.callLater(self.max_delay, self.flush)
+        finally:
+            SAVE_SECONDS.observe(time.perf_counter() - started, target=self.name)
+
+    def _schedule(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            # wait for the changes to settle, but not past max_delay since the first unsaved change
+            deadline = self._dirty_since + self.max_delay
+        delay = max(0, min(self.delay, deadline - time.monotonic()))
+
+        if self._call is not None and self._call.active():
+            self._call.reset(delay)
+        else:
+            self._call = reactor.callLater(delay, self.flush)
@@ -0,0 +1,85 @@
+from __future__ import unicode_literals
+
+import asyncio
+import re
+from base64 import b32decode, b64decode
+from collections import OrderedDict
+from typing import Dict
+from urllib.parse import parse_qs, urlsplit
+
+from deluge.bencode import bdecode
+from deluge.ui.common import TorrentInfo
+
+from delugram.logger import log
+
+BTIH_PREFIX = 'urn:btih:'
+
+
+def magnet_info_hash(magnet):
+    """Returns the lowercase hex info-hash of a magnet link, or None if it doesn't carry a btih."""
+    try:
+        params = parse_qs(urlsplit(magnet.strip()).query)
+    except ValueError:
+        return None
+
+    for xt in params.get('xt', []):
+        if not xt.lower().startswith(BTIH_PREFIX):
+            continue
+        value = xt[len(BTIH_PREFIX):]
+        if re.fullmatch(r'[0-9a-fA-F]{40}', value):
+            return value.lower()
+        if re.fullmatch(r'[A-Za-z2-7]{32}', value):
+            return b32decode(value.upper()).hex()
+    return None
+
+
+def count_files(encoded_metadata):
+    metadata = bdecode(b64decode(encoded_metadata))
+    return len(TorrentInfo.from_metadata(metadata).files)
+
+
+class MagnetPrefetcher(object):
+    """
+    Fetches magnet metadata (through `fetch`, a coroutine function returning the core's
+    `(info_hash, encoded_metadata)` tuple) to find out how many files a magnet has.
+
+    Requests are keyed by info-hash: concurrent requests for the same magnet share one fetch, at most
+    `max_concurrent` DHT fetches run at a time, and decoded file counts are kept in an LRU cache so
+    re-adding a magnet doesn't fetch it again. Must be used on a single event loop.
+    """
+
+    def __init__(self, fetch, max_concurrent=4, cache_size=512):
+        self.fetch = fetch
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def file_count(self, magnet):
+        key = magnet_info_hash(magnet) or magnet.strip()
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        task = self.in_flight.get(key, None)
+        if task is None:
+            task = self.in_flight[key] = asyncio.get_running_loop().create_task(self._fetch(key, magnet))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            log.debug(f"Joining in-flight metadata fetch for {key}")
+
+        # one waiter giving up must not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, magnet):
+        async with self._slots:
+            info_hash, encoded_metadata = await self.fetch(magnet)
+
+        # decoding metadata of torrents with thousands of files takes a while, keep it off the loop
+        count = await asyncio.get_running_loop().run_in_executor(None, count_files, encoded_metadata)
+
+        self.cache[key] = count
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return count
@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from delugram.logger import log
+
+# seconds between two stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# frames kept per allocation when tracing memory
+TRACEMALLOC_FRAMES = 25
+# number of entries in the text summaries
+SUMMARY_LINES = 50
+# seconds to wait for the event loop to switch cProfile off
+STOP_TIMEOUT = 5
+MODES = ('sampling', 'cprofile')
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of one thread from a background thread every `interval` seconds, counting how often
+    each stack was seen. Cheap enough for a production daemon, and it also catches what the thread is
+    stuck in when it never returns to the event loop.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = defaultdict(int)
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='delugram-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path):
+        """Writes the stacks in the folded format flamegraph.pl and speedscope read"""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+
+class LoopProfiler(object):
+    """
+    Profiles the bot's event loop thread on demand, writing the results to `directory`.
+
+    Modes are 'sampling' (SamplingProfiler, low overhead) and 'cprofile' (exact call counts and times,
+    switched on and off from within the loop so only its thread is profiled; since python 3.12 cProfile
+    sees every thread regardless). Memory tracing with tracemalloc can be added to either. It covers the
+    whole process, as tracemalloc can't tell threads apart, and reports what was allocated and is still
+    alive since profiling started.
+
+    Profiling stops after `duration` seconds, or when `stop()` is called, whichever is first.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths: List[str] = []
+        self._lock = threading.Lock()
+        # held while a profile is written, so a concurrent stop() returns its paths once they exist
+        self._writing = threading.Lock()
+        self._session: Optional[Dict] = None
+
+    @property
+    def running(self):
+        return self._session is not None
+
+    def start(self, loop, thread_id, mode='sampling', duration=60, memory=False):
+        """Starts profiling the thread running loop. Returns a description of the session."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, use one of {', '.join(MODES)}")
+
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("Already profiling")
+
+            session = {
+                'mode': mode,
+                'memory': memory,
+                'started': time.time(),
+                'duration': duration,
+                'name': time.strftime('%Y%m%d-%H%M%S'),
+                'loop': loop,
+            }
+            if mode == 'cprofile':
+                session['profile'] = profile = cProfile.Profile()
+                loop.call_soon_threadsafe(profile.enable)
+            else:
+                session['sampler'] = SamplingProfiler(thread_id)
+                session['sampler'].start()
+
+            if memory:
+                session['stop_tracing'] = not tracemalloc.is_tracing()
+                if session['stop_tracing']:
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                session['baseline'] = tracemalloc.take_snapshot()
+
+            session['timer'] = timer = threading.Timer(duration, self.stop)
+            timer.daemon = True
+            timer.start()
+            self._session = session
+
+        log.info(f"Profiling the event loop ({mode}{' and memory' if memory else ''}) for {duration}s")
+        return {key: session[key] for key in ('mode', 'memory', 'started', 'duration')}
+
+    def stop(self):
+        """Stops profiling and writes the results. Returns the paths written, or those of the last session."""
+        with self._writing:
+            with self._lock:
+                session, self._session = self._session, None
+            if session is None:
+                return self.paths
+            return self._write(session)
+
+    def _write(self, session):
+        session['timer'].cancel()
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"profile-{session['name']}")
+        paths = []
+
+        try:
+            if session['mode'] == 'cprofile':
+                paths.extend(self._stop_cprofile(session, base))
+            else:
+                sampler = session['sampler']
+                sampler.stop()
+                sampler.dump(base + '.folded')
+                paths.append(base + '.folded')
+
+            if session['memory']:
+                paths.extend(self._stop_tracemalloc(session, base))
+        except Exception as e:
+            log.error(f"Failed to write profile {base}: {e}")
+            raise
+        finally:
+            self.paths = paths
+
+        log.info(f"Profile written to {', '.join(paths)}")
+        return paths
+
+    @staticmethod
+    def _stop_cprofile(session, base):
+        profile = session['profile']
+        # disable() only affects the calling thread, so it has to run on the loop
+        disabled = threading.Event()
+
+        def disable():
+            profile.disable()
+            disabled.set()
+
+        session['loop'].call_soon_threadsafe(disable)
+        if not disabled.wait(STOP_TIMEOUT):
+            raise RuntimeError(f"The event loop didn't respond within {STOP_TIMEOUT}s")
+
+        profile.dump_stats(base + '.prof')
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+        with open(base + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+        return [base + '.prof', base + '.txt']
+
+    @staticmethod
+    def _stop_tracemalloc(session, base):
+        snapshot = tracemalloc.take_snapshot()
+        if session['stop_tracing']:
+            tracemalloc.stop()
+
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+        snapshot = snapshot.filter_traces(ignore)
+        snapshot.dump(base + '.tracemalloc')
+
+        with open(base + '-memory.txt', 'w') as f:
+            f.write(f"Top {SUMMARY_LINES} allocations since profiling started\n\n")
+            for stat in snapshot.compare_to(session['baseline'].filter_traces(ignore), 'lineno')[:SUMMARY_LINES]:
+                f.write(f"{stat}\n")
+        return [base + '.tracemalloc', base + '-memory.txt']
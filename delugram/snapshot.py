@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class StatusSnapshot(object):
+    """
+    Columnar view over the result of a single `get_torrents_status` query.
+
+    Each requested status key is stored as one column (a list aligned with `torrent_ids`), so
+    sorting and filtering only touch the columns they need, while `row()` rebuilds the status dict
+    `format_torrent_info` expects for the handful of torrents that actually get rendered.
+    """
+
+    def __init__(self, status_dict: Dict[str, Dict[str, Any]], keys: Iterable[str]):
+        self.keys: List[str] = list(keys)
+        self.torrent_ids: List[str] = list(status_dict)
+        self.columns: Dict[str, List[Any]] = {
+            key: [status_dict[torrent_id].get(key, None) for torrent_id in self.torrent_ids] for key in self.keys
+        }
+        self._positions: Dict[str, int] = {torrent_id: i for i, torrent_id in enumerate(self.torrent_ids)}
+
+    def __len__(self):
+        return len(self.torrent_ids)
+
+    def __contains__(self, torrent_id):
+        return torrent_id in self._positions
+
+    def column(self, key) -> List[Any]:
+        return self.columns[key]
+
+    def row(self, torrent_id) -> Dict[str, Any]:
+        position = self._positions[torrent_id]
+        return {key: self.columns[key][position] for key in self.keys}
+
+    def select(self, key, values, torrent_ids: Optional[Iterable[str]] = None) -> List[int]:
+        """
+        Returns positions of the torrents whose `key` column is one of `values`, optionally
+        only looking at the given torrent_ids (ids missing from the snapshot are skipped)
+        """
+        values = frozenset(values)
+        column = self.columns[key]
+        if torrent_ids is None:
+            return [i for i, value in enumerate(column) if value in values]
+
+        positions = (self._positions.get(torrent_id, None) for torrent_id in torrent_ids)
+        return [i for i in positions if i is not None and column[i] in values]
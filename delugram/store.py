@@ -0,0 +1,145 @@
+from __future__ import unicode_literals
+
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from delugram.logger import log
+from delugram.persistence import WriteBehind
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS torrents (
+        torrent_id TEXT PRIMARY KEY,
+        chat_id TEXT NOT NULL,
+        name TEXT,
+        added REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS torrents_chat_id ON torrents (chat_id)",
+)
+
+# a torrent has one owner, adding it for another chat hands it over (the original name goes with it)
+UPSERT = """INSERT INTO torrents (torrent_id, chat_id, name, added) VALUES (?, ?, ?, ?)
+    ON CONFLICT (torrent_id) DO UPDATE SET chat_id = excluded.chat_id, name = excluded.name, added = excluded.added
+    WHERE torrents.chat_id != excluded.chat_id"""
+DELETE = "DELETE FROM torrents WHERE torrent_id = ?"
+
+# sqlite refuses statements with more host parameters than this (on older versions)
+MAX_PARAMETERS = 900
+
+
+class OwnershipStore(object):
+    """
+    Which chat added which torrent, and the torrent's original name, in an sqlite database.
+
+    Writes are queued in memory and committed in a single transaction by a WriteBehind, so a burst of
+    adds or removals costs one commit instead of a rewrite of the whole map. Reads see queued writes,
+    as they apply the queue first. That makes a read commit too, so the bot's event loop doesn't read
+    inline but hands reads to the reactor thread.
+    """
+
+    def __init__(self, path, delay=2.0, max_delay=30.0):
+        self.path = path
+        self._lock = threading.RLock()
+        self._pending: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.writer = WriteBehind(self.flush, delay=delay, max_delay=max_delay, name='torrent ownership')
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.db.close()
+
+    def add(self, torrent_id, chat_id, name):
+        self._queue(UPSERT, (str(torrent_id), str(chat_id), name, time.time()))
+
+    def remove(self, torrent_id):
+        self._queue(DELETE, (str(torrent_id),))
+
+    def _queue(self, sql, params):
+        with self._lock:
+            self._pending.append((sql, params))
+        self.writer.mark_dirty()
+
+    def flush(self):
+        """Commits the queued writes in one transaction. Also done by reads, so they see the queued writes."""
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+
+            pending, self._pending = self._pending, []
+            try:
+                self.db.execute("BEGIN")
+                for sql, params in pending:
+                    self.db.execute(sql, params)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                # keep them for the next attempt
+                self._pending = pending + self._pending
+                raise
+            log.debug(f"Committed {len(pending)} torrent ownership changes")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            self.flush()
+            return self.db.execute(sql, params).fetchall()
+
+    def owners(self, chat_ids: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """Returns torrent_id -> chat_id of all torrents, or of those owned by one of chat_ids"""
+        if chat_ids is None:
+            return dict(self._query("SELECT torrent_id, chat_id FROM torrents"))
+
+        owners = {}
+        chat_ids = [str(chat_id) for chat_id in chat_ids]
+        for i in range(0, len(chat_ids), MAX_PARAMETERS):
+            chunk = chat_ids[i:i + MAX_PARAMETERS]
+            owners.update(self._query(
+                f"SELECT torrent_id, chat_id FROM torrents WHERE chat_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return owners
+
+    def chat_torrents(self, chat_id) -> List[str]:
+        """Returns the ids of the torrents owned by chat_id"""
+        return [row[0] for row in self._query("SELECT torrent_id FROM torrents WHERE chat_id = ?", (str(chat_id),))]
+
+    def names(self, torrent_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Returns torrent_id -> the name the torrent had when it was added, for the known torrent_ids"""
+        names = {}
+        torrent_ids = [str(torrent_id) for torrent_id in torrent_ids]
+        for i in range(0, len(torrent_ids), MAX_PARAMETERS):
+            chunk = torrent_ids[i:i + MAX_PARAMETERS]
+            names.update(self._query(
+                f"SELECT torrent_id, name FROM torrents WHERE torrent_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return names
+
+    def import_chat_torrents(self, chat_torrents):
+        """
+        Imports the chat_torrents map delugram.conf used to hold (chat_id -> {torrent_id: name}, or
+        chat_id -> [torrent_id] in older versions) in one transaction. Returns the number of torrents imported.
+        """
+        added = time.time()
+        rows = []
+        for chat_id, torrents in chat_torrents.items():
+            if isinstance(torrents, dict):
+                rows.extend((str(torrent_id), str(chat_id), name, added) for torrent_id, name in torrents.items())
+            elif isinstance(torrents, list):
+                rows.extend((str(torrent_id), str(chat_id), None, added) for torrent_id in torrents)
+
+        with self._lock:
+            self.flush()
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany(UPSERT, rows)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return len(rows)
@@ -0,0 +1,111 @@
+from __future__ import unicode_literals
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from delugram.logger import log
+from delugram.metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+# seconds between two heartbeats on the event loop
+HEARTBEAT_INTERVAL = 0.1
+# stalls kept for inspection (e.g. by tests)
+MAX_RECORDED_STALLS = 100
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# frames of these files wrap handlers, they don't name one
+WRAPPER_FILES = {os.path.join(PACKAGE_DIR, name) for name in ('metrics.py', 'watchdog.py')}
+
+
+def find_handler(frame):
+    """
+    Returns the name of the function blocking the loop: the innermost delugram function of the callback
+    the loop is running, or the innermost function of all if the callback has no delugram code in it.
+    """
+    innermost = frame
+    while frame is not None:
+        code = frame.f_code
+        # frames below this belong to the loop itself, not to the callback
+        if code.co_filename == asyncio.events.__file__ and code.co_name == '_run':
+            break
+        if code.co_filename.startswith(PACKAGE_DIR) and code.co_filename not in WRAPPER_FILES:
+            return getattr(code, 'co_qualname', code.co_name)
+        frame = frame.f_back
+    return getattr(innermost.f_code, 'co_qualname', innermost.f_code.co_name) if innermost is not None else 'unknown'
+
+
+class LoopWatchdog(object):
+    """
+    Detects callbacks blocking the event loop it is started on.
+
+    A heartbeat coroutine wakes up every `interval` seconds and records how late it was (the loop's
+    scheduling lag). A separate thread checks the last heartbeat, and when the loop hasn't gotten to it
+    for `threshold` seconds, logs the loop thread's stack and the delugram handler in it, and counts
+    the stall. The most recent stalls are kept in `stalls`, as (handler, seconds) pairs, for tests to
+    assert on. The watchdog only ever reads the loop thread's stack, it never interferes with the loop.
+    """
+
+    def __init__(self, threshold=0.5, interval=HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Tuple[str, float]] = deque(maxlen=MAX_RECORDED_STALLS)
+
+        self.thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        """Starts watching the running loop. Must be awaited on that loop."""
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat(), name='delugram-heartbeat')
+        self._thread = threading.Thread(target=self._watch, name='delugram-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, self.last_beat - expected))
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stopped.wait(self.interval):
+            # the heartbeat is due `interval` seconds after the last one, anything beyond that is lag
+            lag = time.monotonic() - self.last_beat - self.interval
+            if lag < self.threshold:
+                if stalled_since is not None:
+                    log.warning(f"Event loop was blocked for {time.monotonic() - stalled_since:.2f}s")
+                    stalled_since = None
+                continue
+
+            if stalled_since is None:
+                stalled_since = self.last_beat + self.interval
+                self._report(lag)
+
+    def _report(self, lag):
+        frame = sys._current_frames().get(self.thread_id, None)
+        handler = find_handler(frame)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        del frame
+
+        LOOP_STALLS.inc(handler=handler)
+        self.stalls.append((handler, lag))
+        log.warning(f"Event loop blocked for {lag:.2f}s (threshold {self.threshold}s) in {handler}:\n{stack}")
@@ -50,7 +50,7 @@ setup(
     license=__license__,
     long_description=__long_description__,
 
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*', 'tests', 'tests.*']),
     package_data=__pkg_data__,
 
     entry_points="""
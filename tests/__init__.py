@@ -0,0 +1,5 @@
+"""
+Unit tests for delugram's building blocks that don't need a deluge daemon or a bot.
+
+    python -m unittest discover tests
+"""
@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+import html
+import unittest
+
+from delugram.digest import MAX_MESSAGE_LENGTH, MAX_NAME_LENGTH, NotificationDigest, split_message
+
+
+class SplitMessageTest(unittest.TestCase):
+    def test_short_message_is_not_split(self):
+        self.assertEqual(split_message('Title', ['\na', '\nb']), ['Title\na\nb'])
+
+    def test_message_of_exactly_max_length_is_not_split(self):
+        line = '\n' + 'x' * (MAX_MESSAGE_LENGTH - len('Title') - 1)
+        self.assertEqual(split_message('Title', [line]), ['Title' + line])
+
+    def test_one_character_more_starts_a_continued_message(self):
+        lines = ['\n' + 'x' * (MAX_MESSAGE_LENGTH - len('Title') - 2), '\nyy']
+        messages = split_message('Title', lines)
+        self.assertEqual(messages, ['Title' + lines[0], 'Title (continued)\nyy'])
+
+    def test_lines_are_never_split(self):
+        lines = ['\n• <b>%04d</b>' % i for i in range(1000)]
+        messages = split_message('Title', lines)
+
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(message) <= MAX_MESSAGE_LENGTH for message in messages))
+        self.assertEqual(''.join(messages).count('<b>'), 1000)
+        self.assertEqual(''.join(messages).count('</b>'), 1000)
+
+    def test_overlong_line_is_cut_short(self):
+        messages = split_message('Title', ['\n' + 'a&amp;b' * 1000])
+        # cut on the unescaped text, so no entity is cut in half
+        self.assertEqual(messages, ['Title\n' + html.escape(('a&b' * 1000)[:MAX_NAME_LENGTH]) + '…'])
+
+
+class RenderTest(unittest.TestCase):
+    def test_single_event_is_bold_and_escaped(self):
+        self.assertEqual(NotificationDigest.render([('added', 'a <b> & c')]),
+                         ['Torrent added: <b>a &lt;b&gt; &amp; c</b>'])
+
+    def test_events_are_grouped_by_kind(self):
+        messages = NotificationDigest.render([('added', 'a'), ('finished', 'f'), ('added', 'b')])
+        self.assertEqual(messages, ['Torrents added (2):\n• <b>a</b>\n• <b>b</b>', 'Torrent finished: <b>f</b>'])
+
+    def test_overlong_names_are_cut(self):
+        message, = NotificationDigest.render([('finished', 'x' * 5000)])
+        self.assertEqual(message, 'Torrent finished: <b>' + 'x' * MAX_NAME_LENGTH + '…</b>')
+
+
+if __name__ == '__main__':
+    unittest.main()
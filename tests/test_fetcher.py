@@ -0,0 +1,69 @@
+from __future__ import unicode_literals
+
+import asyncio
+import unittest
+
+import httpx
+
+from delugram.fetcher import FetchError, TorrentFetcher
+
+
+class SlowStream(httpx.AsyncByteStream):
+    """Sends a byte every `interval` seconds, each well within the per-read timeout"""
+
+    def __init__(self, interval, size=100):
+        self.interval = interval
+        self.size = size
+
+    async def __aiter__(self):
+        for _ in range(self.size):
+            await asyncio.sleep(self.interval)
+            yield b'x'
+
+
+class TorrentFetcherTest(unittest.TestCase):
+    def fetch(self, fetcher, handler, *urls):
+        async def run():
+            fetcher.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                results = await asyncio.gather(*(fetcher.fetch(url) for url in urls), return_exceptions=True)
+                self.host_slots = dict(fetcher._host_slots)
+                return results
+            finally:
+                await fetcher.close()
+
+        return asyncio.run(run())
+
+    def test_fetches_body(self):
+        fetcher = TorrentFetcher()
+        result, = self.fetch(fetcher, lambda request: httpx.Response(200, content=b'torrent'), 'http://a/1.torrent')
+        self.assertEqual(result, b'torrent')
+
+    def test_rejects_oversized_body(self):
+        fetcher = TorrentFetcher(max_size=4)
+        result, = self.fetch(fetcher, lambda request: httpx.Response(200, content=b'torrent'), 'http://a/1.torrent')
+        self.assertIsInstance(result, FetchError)
+
+    def test_trickling_download_hits_the_deadline(self):
+        fetcher = TorrentFetcher(deadline=0.05)
+        result, = self.fetch(fetcher, lambda request: httpx.Response(200, stream=SlowStream(0.01)),
+                             'http://a/1.torrent')
+        self.assertIsInstance(result, FetchError)
+        self.assertIn('longer than', str(result))
+
+    def test_host_slots_are_dropped_when_idle(self):
+        fetcher = TorrentFetcher(max_connections_per_host=1)
+        seen = []
+
+        def handler(request):
+            seen.append(dict(fetcher._host_slots))
+            return httpx.Response(200, content=b'torrent')
+
+        results = self.fetch(fetcher, handler, 'http://a/1.torrent', 'http://a/2.torrent', 'http://b/1.torrent')
+        self.assertEqual(results, [b'torrent'] * 3)
+        self.assertTrue(all(set(slots) <= {'a', 'b'} for slots in seen))
+        self.assertEqual(self.host_slots, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+from __future__ import unicode_literals
+
+import asyncio
+import json
+import unittest
+from types import SimpleNamespace
+
+import delugram.core
+from delugram.core import Core, DEFAULT_PREFS
+from delugram.httpserver import HttpListener, MAX_BODY_SIZE
+
+SECRET = 'secret-token'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': 'hi'}}
+
+
+async def request(port, method, path, headers=None, body=b''):
+    """Sends one request on a new connection. Returns the status code and body of the response."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        head = {'Host': 'localhost', 'Content-Length': str(len(body)), 'Connection': 'close', **(headers or {})}
+        writer.write((f"{method} {path} HTTP/1.1\r\n" +
+                      ''.join(f"{name}: {value}\r\n" for name, value in head.items()) + "\r\n").encode('latin-1') + body)
+        response = await reader.read()
+    finally:
+        writer.close()
+    status_line, _, rest = response.partition(b'\r\n')
+    return int(status_line.split()[1]), rest.partition(b'\r\n\r\n')[2]
+
+
+class ListenerTestCase(unittest.TestCase):
+    """Runs `handler` on an HttpListener bound to a free local port, in a fresh event loop per test"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.listener = HttpListener('127.0.0.1', 0, self.handler, name='test')
+        self.loop.run_until_complete(self.listener.start())
+        self.addCleanup(lambda: self.loop.run_until_complete(self.listener.stop()))
+        self.port = self.listener.server.sockets[0].getsockname()[1]
+
+    async def handler(self, method, path, headers, body):
+        raise NotImplementedError
+
+    def request(self, method, path, headers=None, body=b''):
+        return self.loop.run_until_complete(request(self.port, method, path, headers, body))
+
+
+class HttpListenerTest(ListenerTestCase):
+    async def handler(self, method, path, headers, body):
+        if path == '/fail':
+            raise RuntimeError("handler failed")
+        return 200, 'text/plain', f"{method} {path} {headers.get('x-test', '')} {len(body)}".encode('utf-8')
+
+    def test_passes_request_to_handler(self):
+        self.assertEqual(self.request('POST', '/path?q=1', {'X-Test': 'value'}, b'body'),
+                         (200, b'POST /path?q=1 value 4'))
+
+    def test_handler_exception_is_a_server_error(self):
+        self.assertEqual(self.request('GET', '/fail'), (500, b''))
+
+    def test_rejects_oversized_body_without_reading_it(self):
+        status, _ = self.request('POST', '/', {'Content-Length': str(MAX_BODY_SIZE + 1)})
+        self.assertEqual(status, 413)
+
+    def test_rejects_invalid_content_length(self):
+        self.assertEqual(self.request('POST', '/', {'Content-Length': '-1'})[0], 400)
+
+    def test_keep_alive_serves_several_requests(self):
+        async def two_requests():
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+            try:
+                statuses = []
+                for _ in range(2):
+                    writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                    status_line = await reader.readline()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line == b'\r\n':
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.lower()] = value.strip()
+                    await reader.readexactly(int(headers['content-length']))
+                    statuses.append((int(status_line.split()[1]), headers['connection']))
+                return statuses
+            finally:
+                writer.close()
+
+        self.assertEqual(self.loop.run_until_complete(two_requests()), [(200, 'keep-alive')] * 2)
+
+
+class WebhookRequestTest(ListenerTestCase):
+    """Core.handle_webhook_request behind a listener, the way the webhook update mode runs it"""
+
+    @classmethod
+    def setUpClass(cls):
+        delugram.core.load_telegram()
+
+    def setUp(self):
+        self.updates = asyncio.Queue()
+        self.core = SimpleNamespace(
+            config={**DEFAULT_PREFS, 'webhook_secret': SECRET},
+            telegram=SimpleNamespace(bot=None, update_queue=self.updates),
+        )
+        super().setUp()
+
+    async def handler(self, method, path, headers, body):
+        return await Core.handle_webhook_request(self.core, method, path, headers, body)
+
+    def post(self, body, secret=SECRET, path=DEFAULT_PREFS['webhook_path']):
+        headers = {'Content-Type': 'application/json'}
+        if secret is not None:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+        return self.request('POST', path, headers, body)[0]
+
+    def test_update_with_secret_is_queued(self):
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8')), 200)
+        update = self.updates.get_nowait()
+        self.assertEqual(update.update_id, 1)
+        self.assertEqual(update.message.text, 'hi')
+
+    def test_missing_secret_is_forbidden(self):
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'), secret=None), 403)
+        self.assertTrue(self.updates.empty())
+
+    def test_wrong_secret_is_forbidden(self):
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'), secret='wrong'), 403)
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'), secret=SECRET + 'x'), 403)
+        self.assertTrue(self.updates.empty())
+
+    def test_no_request_is_trusted_without_a_configured_secret(self):
+        self.core.config['webhook_secret'] = ''
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'), secret=''), 403)
+        self.assertTrue(self.updates.empty())
+
+    def test_bad_body_is_a_bad_request(self):
+        for body in (b'not json', b'[1, 2]', b'{"message": {}}', b'\xff'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body), 400)
+        self.assertTrue(self.updates.empty())
+
+    def test_unknown_path_is_not_found(self):
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'), path='/other'), 404)
+        self.assertTrue(self.updates.empty())
+
+    def test_path_ignores_query_string(self):
+        self.assertEqual(self.post(json.dumps(UPDATE).encode('utf-8'),
+                                   path=DEFAULT_PREFS['webhook_path'] + '?x=1'), 200)
+
+    def test_wrong_method_is_not_allowed(self):
+        self.assertEqual(self.request('GET', DEFAULT_PREFS['webhook_path'],
+                                      {'X-Telegram-Bot-Api-Secret-Token': SECRET})[0], 405)
+
+
+class PortConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.core = SimpleNamespace(config={'webhook_port': 8443, 'metrics_port': 0, 'webhook_path': '/delugram'},
+                                    save_config=lambda: None, rebuild_chat_permissions=lambda: None)
+
+    def set_config(self, config):
+        Core.set_config(self.core, config)
+
+    def test_ports_are_stored_as_numbers(self):
+        self.set_config({'webhook_port': '8080', 'metrics_port': 9100.0})
+        self.assertEqual(self.core.config['webhook_port'], 8080)
+        self.assertEqual(self.core.config['metrics_port'], 9100)
+
+    def test_invalid_port_leaves_config_untouched(self):
+        for config in ({'webhook_port': ''}, {'webhook_port': 'abc'}, {'webhook_port': 0},
+                       {'webhook_port': 65536}, {'webhook_port': 80.5}, {'metrics_port': -1}, {'metrics_port': ''}):
+            with self.subTest(config=config):
+                with self.assertRaises(ValueError):
+                    self.set_config({'webhook_path': '/changed', **config})
+                self.assertEqual(self.core.config,
+                                 {'webhook_port': 8443, 'metrics_port': 0, 'webhook_path': '/delugram'})
+
+    def test_metrics_port_may_be_zero(self):
+        self.core.config['metrics_port'] = 9100
+        self.set_config({'metrics_port': 0})
+        self.assertEqual(self.core.config['metrics_port'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import unittest
+from datetime import datetime, timezone
+
+from deluge.common import is_magnet, is_url
+from telegram import Chat, Message, MessageEntity
+
+from delugram.core import MAGNET_PATTERN, URL_PATTERN, extract_links, message_link_text
+from delugram.prefetch import magnet_info_hash
+
+HASH_A = 'a' * 40
+HASH_B = 'b' * 40
+
+
+def extract_magnets(text):
+    # keyed like ingest_magnets does, so the same torrent is only added once
+    return extract_links(text, MAGNET_PATTERN, is_magnet, key=lambda m: magnet_info_hash(m) or m)
+
+
+def extract_urls(text):
+    return extract_links(text, URL_PATTERN, is_url)
+
+
+def message(text, *links):
+    """A message with text, and a text link to each of links (on its first character)"""
+    entities = [MessageEntity(MessageEntity.TEXT_LINK, 0, 1, url=link) for link in links]
+    return Message(1, datetime.now(timezone.utc), Chat(1, Chat.PRIVATE), text=text, entities=entities)
+
+
+class ExtractLinksTest(unittest.TestCase):
+    def test_magnets_in_text_in_order(self):
+        text = f"first magnet:?xt=urn:btih:{HASH_A}&dn=a\nthen\tmagnet:?xt=urn:btih:{HASH_B} and done"
+        self.assertEqual(extract_magnets(text),
+                         [f"magnet:?xt=urn:btih:{HASH_A}&dn=a", f"magnet:?xt=urn:btih:{HASH_B}"])
+
+    def test_duplicate_magnets_are_added_once(self):
+        text = '\n'.join([f"magnet:?xt=urn:btih:{HASH_A}&dn=first",
+                          f"MAGNET:?xt=urn:btih:{HASH_A.upper()}&dn=second",
+                          f"magnet:?xt=urn:btih:{HASH_A}&dn=first"])
+        self.assertEqual(extract_magnets(text), [f"magnet:?xt=urn:btih:{HASH_A}&dn=first"])
+
+    def test_magnets_without_btih_are_skipped(self):
+        self.assertEqual(extract_magnets("magnet:?dn=no-hash magnet: magnet:?xt=urn:sha1:abc"), [])
+
+    def test_magnets_with_malformed_hash_are_deduplicated_by_link(self):
+        # deluge accepts these and reports the error when adding, they have no info-hash to be keyed by
+        text = "magnet:?xt=urn:btih:short magnet:?xt=urn:btih:short magnet:?xt=urn:btih:other"
+        self.assertEqual(extract_magnets(text), ["magnet:?xt=urn:btih:short", "magnet:?xt=urn:btih:other"])
+
+    def test_urls_in_text_without_duplicates(self):
+        text = "https://a.example/1.torrent and http://b.example/2.torrent\nagain https://a.example/1.torrent"
+        self.assertEqual(extract_urls(text), ["https://a.example/1.torrent", "http://b.example/2.torrent"])
+
+    def test_urls_differing_in_case_or_query_are_distinct(self):
+        text = "https://a.example/1.torrent https://a.example/1.torrent?x=1 https://a.example/1.TORRENT"
+        self.assertEqual(extract_urls(text), text.split())
+
+    def test_url_and_magnet_patterns_keep_apart(self):
+        text = f"https://a.example/1.torrent magnet:?xt=urn:btih:{HASH_A}"
+        self.assertEqual(extract_urls(text), ["https://a.example/1.torrent"])
+        self.assertEqual(extract_magnets(text), [f"magnet:?xt=urn:btih:{HASH_A}"])
+
+    def test_no_text(self):
+        self.assertEqual(extract_urls(None), [])
+        self.assertEqual(extract_magnets(''), [])
+
+
+class MessageLinkTextTest(unittest.TestCase):
+    def test_text_links_are_found(self):
+        text = message_link_text(message("these two", "https://a.example/1.torrent", "https://b.example/2.torrent"))
+        self.assertEqual(extract_urls(text), ["https://a.example/1.torrent", "https://b.example/2.torrent"])
+
+    def test_text_link_duplicating_the_text_is_added_once(self):
+        text = message_link_text(message("https://a.example/1.torrent", "https://a.example/1.torrent"))
+        self.assertEqual(extract_urls(text), ["https://a.example/1.torrent"])
+
+    def test_magnet_behind_a_text_link(self):
+        text = message_link_text(message(f"magnet:?xt=urn:btih:{HASH_A}", f"magnet:?xt=urn:btih:{HASH_B}"))
+        self.assertEqual(extract_magnets(text), [f"magnet:?xt=urn:btih:{HASH_A}", f"magnet:?xt=urn:btih:{HASH_B}"])
+
+    def test_other_entities_are_ignored(self):
+        msg = Message(1, datetime.now(timezone.utc), Chat(1, Chat.PRIVATE), text="see https://a.example/x",
+                      entities=[MessageEntity(MessageEntity.URL, 4, 19), MessageEntity(MessageEntity.BOLD, 0, 3)])
+        self.assertEqual(message_link_text(msg), "see https://a.example/x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+
+import asyncio
+import unittest
+
+from delugram.core import Core
+from delugram.metrics import Registry, timed
+
+
+class HistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.histogram = self.registry.histogram('latency', "Latency", buckets=(0.1, 1.0, 10.0))
+
+    def samples(self):
+        return self.registry.collect()['latency']['samples']
+
+    def test_buckets_are_cumulative_and_bounds_inclusive(self):
+        for value in (0.05, 0.1, 0.5, 5.0, 50.0):
+            self.histogram.observe(value)
+        sample, = self.samples()
+        self.assertEqual(sample['buckets'], [[0.1, 2], [1.0, 3], [10.0, 4]])
+        self.assertEqual(sample['count'], 5)
+        self.assertAlmostEqual(sample['sum'], 55.65)
+
+    def test_labels_are_kept_apart(self):
+        self.histogram.observe(0.5, handler='a')
+        self.histogram.observe(0.5, handler='b')
+        self.histogram.observe(0.5, handler='b')
+        counts = {sample['labels']['handler']: sample['count'] for sample in self.samples()}
+        self.assertEqual(counts, {'a': 1, 'b': 2})
+
+    def test_quantiles_interpolate_within_bucket(self):
+        for _ in range(10):
+            self.histogram.observe(0.5)
+        sample, = self.samples()
+        # all ten fall in (0.1, 1.0], the median is half way through it
+        self.assertAlmostEqual(sample['p50'], 0.55)
+        self.assertAlmostEqual(sample['p99'], 0.991)
+
+    def test_quantile_beyond_last_bucket_is_last_bound(self):
+        self.histogram.observe(50.0)
+        sample, = self.samples()
+        self.assertEqual(sample['p50'], 10.0)
+        self.assertEqual(sample['p99'], 10.0)
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry(namespace='test')
+
+    def test_same_name_returns_same_metric(self):
+        self.assertIs(self.registry.counter('errors', "Errors"), self.registry.counter('errors', "Errors"))
+
+    def test_collect(self):
+        self.registry.counter('errors', "Errors").inc(handler='a')
+        self.registry.gauge('depth', "Depth", lambda: {(('chat', '1'),): 3})
+        self.registry.gauge('broken', "Broken", lambda: 1 / 0)
+        self.assertEqual(self.registry.collect(), {
+            'errors': {'type': 'counter', 'help': "Errors", 'samples': [{'labels': {'handler': 'a'}, 'value': 1}]},
+            'depth': {'type': 'gauge', 'help': "Depth", 'samples': [{'labels': {'chat': '1'}, 'value': 3}]},
+            'broken': {'type': 'gauge', 'help': "Broken", 'samples': []},
+        })
+
+    def test_unregister(self):
+        self.registry.gauge('depth', "Depth", lambda: 1)
+        self.registry.unregister('depth')
+        self.assertEqual(self.registry.collect(), {})
+
+    def test_render(self):
+        self.registry.counter('errors', "Errors").inc(2, handler='say "hi"\n')
+        self.registry.histogram('latency', "Latency", buckets=(0.1, 1.0)).observe(0.5)
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP test_errors Errors',
+            '# TYPE test_errors counter',
+            'test_errors{handler="say \\"hi\\"\\n"} 2',
+            '# HELP test_latency Latency',
+            '# TYPE test_latency histogram',
+            'test_latency_bucket{le="0.1"} 0',
+            'test_latency_bucket{le="1.0"} 1',
+            'test_latency_bucket{le="+Inf"} 1',
+            'test_latency_sum 0.5',
+            'test_latency_count 1',
+        ])
+
+
+class TimedTest(unittest.TestCase):
+    def setUp(self):
+        registry = Registry()
+        self.histogram = registry.histogram('seconds', "Seconds")
+        self.errors = registry.counter('errors', "Errors")
+
+    def observed(self):
+        return {sample['labels']['handler']: sample['count'] for sample in self.histogram.samples()}
+
+    def test_function(self):
+        @timed(self.histogram, self.errors)
+        def handler(fail):
+            if fail:
+                raise ValueError()
+            return 'done'
+
+        self.assertEqual(handler(False), 'done')
+        with self.assertRaises(ValueError):
+            handler(True)
+        self.assertEqual(self.observed(), {'handler': 2})
+        self.assertEqual(self.errors.samples(), [{'labels': {'handler': 'handler'}, 'value': 1}])
+
+    def test_coroutine_function(self):
+        @timed(self.histogram, self.errors, handler='named')
+        async def handler(fail):
+            await asyncio.sleep(0)
+            if fail:
+                raise ValueError()
+            return 'done'
+
+        self.assertTrue(asyncio.iscoroutinefunction(handler))
+        self.assertEqual(asyncio.run(handler(False)), 'done')
+        with self.assertRaises(ValueError):
+            asyncio.run(handler(True))
+        self.assertEqual(self.observed(), {'named': 2})
+        self.assertEqual(self.errors.samples(), [{'labels': {'handler': 'named'}, 'value': 1}])
+
+
+class MetricsRequestTest(unittest.TestCase):
+    def request(self, method, path):
+        # the handler doesn't touch the plugin's state, so it runs without a Core
+        return asyncio.run(Core.handle_metrics_request(None, method, path, {}, b''))
+
+    def test_serves_registry(self):
+        status, content_type, body = self.request('GET', '/metrics?name=x')
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE delugram_telegram_handler_seconds histogram', body.decode('utf-8'))
+
+    def test_unknown_path(self):
+        self.assertEqual(self.request('GET', '/other'), (404, 'text/plain', b''))
+
+    def test_wrong_method(self):
+        self.assertEqual(self.request('POST', '/metrics'), (405, 'text/plain', b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
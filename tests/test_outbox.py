@@ -0,0 +1,197 @@
+from __future__ import unicode_literals
+
+import asyncio
+import random
+import unittest
+from unittest import mock
+
+from telegram.error import BadRequest, NetworkError
+
+from delugram.outbox import Outbox, PRIORITY_ADMIN, PRIORITY_NOTIFICATION, TokenBucket
+
+
+class FakeBot(object):
+    """
+    Records sent messages. Sends take `delay` seconds, or a random moment so concurrent workers finish
+    out of order.
+    """
+
+    def __init__(self, delay=None, seed=0):
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.sent = []
+        # text -> exceptions to raise on the next sends of that text
+        self.failures = {}
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.rng.uniform(0, 0.005) if self.delay is None else self.delay)
+        failures = self.failures.get(text, [])
+        if failures:
+            raise failures.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+    def texts(self, chat_id):
+        return [text for chat, text in self.sent if chat == chat_id]
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('delugram.outbox.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(), 1)
+
+    def test_refills_at_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.take()
+        bucket.take()
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+        self.now += 0.25
+        self.assertAlmostEqual(bucket.take(), 0.25)
+        self.now += 0.25
+        self.assertEqual(bucket.take(), 0)
+
+    def test_never_holds_more_than_capacity(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.now += 60
+        self.assertTrue(bucket.full)
+        self.assertEqual([bucket.take() for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def start(self, bot, **options):
+        options.setdefault('chat_rate', 1000)
+        options.setdefault('chat_burst', 1000)
+        options.setdefault('global_rate', 1000)
+        outbox = Outbox(bot, **options)
+        await outbox.start()
+        self.addAsyncCleanup(outbox.stop)
+        return outbox
+
+    async def test_messages_to_a_chat_arrive_in_order(self):
+        bot = FakeBot()
+        outbox = await self.start(bot, workers=8)
+        for i in range(50):
+            for chat_id in (1, 2, 3):
+                outbox.submit('send_message', chat_id, text=str(i))
+        await outbox.stop()
+
+        for chat_id in (1, 2, 3):
+            self.assertEqual(bot.texts(chat_id), [str(i) for i in range(50)])
+
+    async def test_higher_priority_goes_first_within_a_chat(self):
+        bot = FakeBot(delay=0.02)
+        outbox = await self.start(bot)
+        # the first message keeps the chat busy while the others are queued
+        outbox.submit('send_message', 1, text='first')
+        await asyncio.sleep(0.005)
+        outbox.submit('send_message', 1, text='notification', priority=PRIORITY_NOTIFICATION)
+        outbox.submit('send_message', 1, text='admin', priority=PRIORITY_ADMIN)
+        await outbox.stop()
+
+        self.assertEqual(bot.texts(1), ['first', 'admin', 'notification'])
+
+    async def test_chat_rate_limit_keeps_order(self):
+        bot = FakeBot()
+        outbox = await self.start(bot, chat_rate=100, chat_burst=1)
+        for i in range(5):
+            outbox.submit('send_message', 1, text=str(i))
+        outbox.submit('send_message', 2, text='other chat')
+        await asyncio.sleep(0.01)
+
+        # the other chat isn't held up by the first one's rate limit
+        self.assertEqual(bot.texts(2), ['other chat'])
+        await outbox.stop()
+        self.assertEqual(bot.texts(1), ['0', '1', '2', '3', '4'])
+
+    async def test_submit_drops_beyond_max_queue(self):
+        bot = FakeBot()
+        outbox = await self.start(bot, max_queue=3)
+        for i in range(5):
+            outbox.submit('send_message', 1, text=str(i))
+        self.assertEqual(outbox.depth, 3)
+        self.assertEqual(outbox.dropped, 2)
+
+        await outbox.stop()
+        self.assertEqual(bot.texts(1), ['0', '1', '2'])
+
+    async def test_call_waits_for_room(self):
+        bot = FakeBot()
+        outbox = await self.start(bot, max_queue=2)
+        results = await asyncio.gather(*[outbox.call('send_message', 1, text=str(i)) for i in range(6)])
+
+        self.assertEqual(results, [str(i) for i in range(6)])
+        self.assertEqual(outbox.dropped, 0)
+        self.assertEqual(outbox.depth, 0)
+
+    async def test_deferred_message_is_not_dropped_when_the_outbox_is_full(self):
+        bot = FakeBot(delay=0)
+        outbox = await self.start(bot, max_queue=2, chat_rate=50, chat_burst=1)
+        first = outbox.call('send_message', 1, text='first')
+        # has to wait ~20ms for chat 1's bucket
+        second = outbox.call('send_message', 1, text='second')
+        results = asyncio.gather(first, second)
+        await asyncio.sleep(0.005)
+
+        # fill the room the first message left while the second one waits for its bucket
+        outbox.submit('send_message', 2, text='filler')
+        outbox.submit('send_message', 3, text='dropped')
+
+        self.assertEqual(await results, ['first', 'second'])
+        self.assertEqual(outbox.dropped, 1)
+        await outbox.stop()
+        self.assertEqual(bot.texts(2), ['filler'])
+
+    async def test_network_errors_are_retried_in_order(self):
+        bot = FakeBot()
+        bot.failures['flaky'] = [NetworkError('reset')]
+        outbox = await self.start(bot)
+        results = await asyncio.gather(*[outbox.call('send_message', 1, text=text) for text in ('flaky', 'next')])
+
+        self.assertEqual(results, ['flaky', 'next'])
+        self.assertEqual(bot.texts(1), ['flaky', 'next'])
+
+    async def test_gives_up_after_max_retries(self):
+        bot = FakeBot()
+        bot.failures['broken'] = [NetworkError('reset')]
+        outbox = await self.start(bot, max_retries=0)
+
+        with self.assertRaises(NetworkError):
+            await outbox.call('send_message', 1, text='broken')
+        self.assertEqual(await outbox.call('send_message', 1, text='next'), 'next')
+
+    async def test_bad_request_is_not_retried(self):
+        bot = FakeBot()
+        bot.failures['bad'] = [BadRequest("can't parse entities")]
+        outbox = await self.start(bot)
+
+        with self.assertRaises(BadRequest):
+            await outbox.call('send_message', 1, text='bad')
+        self.assertEqual(bot.sent, [])
+
+    async def test_stop_fails_what_could_not_be_sent(self):
+        bot = FakeBot()
+        outbox = await self.start(bot, chat_rate=0.1, chat_burst=1)
+        sent = asyncio.ensure_future(outbox.call('send_message', 1, text='sent'))
+        waiting = asyncio.ensure_future(outbox.call('send_message', 1, text='waiting'))
+        held = asyncio.ensure_future(outbox.call('send_message', 1, text='held'))
+        await asyncio.sleep(0.01)
+
+        await outbox.stop(timeout=0.05)
+        self.assertEqual(await sent, 'sent')
+        for future in (waiting, held):
+            with self.assertRaisesRegex(RuntimeError, "Outbox stopped"):
+                await future
+        self.assertEqual((outbox.depth, outbox.lanes, outbox.held, outbox.deferred), (0, {}, {}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+import unittest
+from unittest import mock
+
+from delugram.pagecache import PageCache
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('delugram.pagecache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = PageCache(ttl=5)
+
+    def test_serves_page_until_ttl(self):
+        self.cache.put(1, 'status', 'page', self.cache.generation(1))
+        self.now += 4.9
+        self.assertEqual(self.cache.get(1, 'status'), 'page')
+        self.now += 0.1
+        self.assertIsNone(self.cache.get(1, 'status'))
+
+    def test_invalidate_drops_only_that_chat(self):
+        self.cache.put(1, 'status', 'one', self.cache.generation(1))
+        self.cache.put(2, 'status', 'two', self.cache.generation(2))
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1, 'status'))
+        self.assertEqual(self.cache.get(2, 'status'), 'two')
+
+    def test_page_rendered_during_invalidation_is_never_served(self):
+        generation = self.cache.generation(1)
+        # a torrent event arrives while the page is being rendered
+        self.cache.invalidate(1)
+        self.cache.put(1, 'status', 'stale', generation)
+        self.assertIsNone(self.cache.get(1, 'status'))
+
+        self.cache.put(1, 'status', 'fresh', self.cache.generation(1))
+        self.assertEqual(self.cache.get(1, 'status'), 'fresh')
+
+    def test_clear_drops_every_chat(self):
+        self.cache.put(1, 'status', 'one', self.cache.generation(1))
+        self.cache.put(2, 'ongoing', 'two', self.cache.generation(2))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(1, 'status'))
+        self.assertIsNone(self.cache.get(2, 'ongoing'))
+
+    def test_full_cache_evicts_expired_entries_first(self):
+        cache = PageCache(ttl=5, max_entries=2)
+        cache.put(1, 'a', 'old', cache.generation(1))
+        self.now += 10
+        cache.put(1, 'b', 'b', cache.generation(1))
+        cache.put(1, 'c', 'c', cache.generation(1))
+        self.assertEqual(set(cache.entries), {(1, 'b'), (1, 'c')})
+
+    def test_stats(self):
+        self.cache.put(1, 'status', 'page', self.cache.generation(1))
+        self.cache.get(1, 'status')
+        self.cache.get(1, 'ongoing')
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from twisted.internet.task import Clock
+
+from delugram import persistence
+from delugram.persistence import WriteBehind
+
+
+def patch_reactor(test):
+    """Runs WriteBehind's timers on a twisted Clock, with time.monotonic following it. Returns the clock."""
+    clock = Clock()
+    for patcher in (mock.patch.object(persistence, 'reactor', clock),
+                    mock.patch.object(persistence.threadable, 'isInIOThread', lambda: True),
+                    mock.patch.object(persistence, 'time',
+                                      SimpleNamespace(monotonic=clock.seconds, perf_counter=time.perf_counter))):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return clock
+
+
+class WriteBehindTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = patch_reactor(self)
+        self.saves = []
+        self.writer = WriteBehind(lambda: self.saves.append(self.clock.seconds()), delay=2, max_delay=5)
+
+    def test_burst_is_saved_once_after_delay(self):
+        for _ in range(100):
+            self.writer.mark_dirty()
+        self.clock.advance(1.9)
+        self.assertEqual(self.saves, [])
+
+        self.clock.advance(0.1)
+        self.assertEqual(self.saves, [2])
+        self.assertFalse(self.writer.dirty)
+
+    def test_each_change_restarts_the_delay(self):
+        self.writer.mark_dirty()
+        self.clock.advance(1.5)
+        self.writer.mark_dirty()
+        self.clock.advance(1.5)
+        self.assertEqual(self.saves, [])
+
+        self.clock.advance(0.5)
+        self.assertEqual(self.saves, [3.5])
+
+    def test_steady_changes_are_saved_by_max_delay(self):
+        for _ in range(6):
+            self.writer.mark_dirty()
+            self.clock.advance(1)
+        self.assertEqual(self.saves, [5])
+
+    def test_flush_saves_right_away_and_cancels_the_timer(self):
+        self.writer.mark_dirty()
+        self.writer.flush()
+        self.assertEqual(self.saves, [0])
+
+        self.clock.advance(10)
+        self.assertEqual(self.saves, [0])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_flush_without_changes_does_not_save(self):
+        self.writer.flush()
+        self.assertEqual(self.saves, [])
+
+    def test_failed_save_is_retried(self):
+        attempts = []
+
+        def save():
+            attempts.append(self.clock.seconds())
+            if len(attempts) < 3:
+                raise IOError("disk full")
+
+        writer = WriteBehind(save, delay=2, max_delay=5)
+        writer.mark_dirty()
+        self.clock.advance(2)
+        self.assertTrue(writer.dirty)
+
+        # retried after backing off for max_delay, without any further change
+        self.clock.advance(4.9)
+        self.assertEqual(attempts, [2])
+        self.clock.advance(0.1)
+        self.assertEqual(attempts, [2, 7])
+        self.assertTrue(writer.dirty)
+
+        self.clock.advance(5)
+        self.assertEqual(attempts, [2, 7, 12])
+        self.assertFalse(writer.dirty)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_change_during_failed_save_is_retried_once(self):
+        attempts = []
+
+        def save():
+            attempts.append(self.clock.seconds())
+            if len(attempts) == 1:
+                writer.mark_dirty()
+                raise IOError("disk full")
+
+        writer = WriteBehind(save, delay=2, max_delay=5)
+        writer.mark_dirty()
+        self.clock.advance(2)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.clock.advance(2)
+        self.assertEqual(attempts, [2, 4])
+        self.clock.advance(10)
+        self.assertEqual(attempts, [2, 4])
+        self.assertFalse(writer.dirty)
+
+if __name__ == '__main__':
+    unittest.main()
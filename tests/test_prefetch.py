@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+
+import unittest
+from base64 import b32encode
+
+from delugram.prefetch import magnet_info_hash
+
+INFO_HASH = '0123456789abcdef0123456789abcdef01234567'
+
+
+class MagnetInfoHashTest(unittest.TestCase):
+    def test_lowercase_hex(self):
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btih:{INFO_HASH}&dn=name"), INFO_HASH)
+
+    def test_uppercase_hex_is_lowercased(self):
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btih:{INFO_HASH.upper()}"), INFO_HASH)
+
+    def test_uppercase_urn_prefix(self):
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=URN:BTIH:{INFO_HASH}"), INFO_HASH)
+
+    def test_base32_is_converted_to_hex(self):
+        encoded = b32encode(bytes.fromhex(INFO_HASH)).decode('ascii')
+        self.assertEqual(len(encoded), 32)
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btih:{encoded}"), INFO_HASH)
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btih:{encoded.lower()}"), INFO_HASH)
+
+    def test_hex_and_base32_of_one_torrent_are_the_same_key(self):
+        encoded = b32encode(bytes.fromhex(INFO_HASH)).decode('ascii')
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btih:{encoded}&dn=a"),
+                         magnet_info_hash(f"  magnet:?dn=b&xt=urn:btih:{INFO_HASH.upper()}  "))
+
+    def test_btih_among_other_xt_values(self):
+        self.assertEqual(magnet_info_hash(f"magnet:?xt=urn:btmh:1220{'0' * 64}&xt=urn:btih:{INFO_HASH}"), INFO_HASH)
+
+    def test_malformed_xt_values(self):
+        for xt in ('urn:btih:', f"urn:btih:{INFO_HASH[:-1]}", f"urn:btih:{INFO_HASH}0",
+                   f"urn:btih:{INFO_HASH[:-1]}g", 'urn:btih:' + 'A' * 31, 'urn:btih:' + 'A' * 33,
+                   'urn:btih:' + '1' * 32, f"urn:sha1:{INFO_HASH}", INFO_HASH):
+            with self.subTest(xt=xt):
+                self.assertIsNone(magnet_info_hash(f"magnet:?xt={xt}"))
+
+    def test_magnet_without_xt(self):
+        self.assertIsNone(magnet_info_hash('magnet:?dn=name&tr=udp://tracker'))
+        self.assertIsNone(magnet_info_hash('magnet:'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+
+import os
+import tempfile
+import unittest
+
+from delugram.store import OwnershipStore
+from tests.test_persistence import patch_reactor
+
+
+class OwnershipStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = patch_reactor(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'delugram.db')
+        self.store = OwnershipStore(self.path, delay=2, max_delay=30)
+        self.addCleanup(self.store.db.close)
+
+    def reopen(self):
+        self.store.close()
+        self.store = OwnershipStore(self.path)
+        self.addCleanup(self.store.db.close)
+        return self.store
+
+    def test_import_of_both_chat_torrents_formats(self):
+        imported = self.store.import_chat_torrents({
+            '1': {'a': 'Torrent A', 'b': 'Torrent B'},
+            2: ['c'],
+            '3': 'not a torrent map',
+        })
+
+        self.assertEqual(imported, 3)
+        self.assertEqual(self.store.owners(), {'a': '1', 'b': '1', 'c': '2'})
+        self.assertEqual(self.store.names(['a', 'c']), {'a': 'Torrent A', 'c': None})
+        self.assertEqual(sorted(self.store.chat_torrents(1)), ['a', 'b'])
+
+    def test_import_keeps_queued_writes(self):
+        self.store.add('a', 1, 'Torrent A')
+        self.store.import_chat_torrents({'2': ['b']})
+        self.assertEqual(self.store.owners(), {'a': '1', 'b': '2'})
+
+    def test_writes_are_queued_and_committed_together(self):
+        self.store.add('a', 1, 'Torrent A')
+        self.store.add('b', 2, 'Torrent B')
+        self.store.remove('a')
+        self.assertEqual(len(self.store._pending), 3)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.clock.advance(2)
+        self.assertEqual(self.store._pending, [])
+        self.assertEqual(self.store.owners(), {'b': '2'})
+
+    def test_reads_see_queued_writes(self):
+        self.store.add('a', 1, 'Torrent A')
+        self.assertEqual(self.store.owners([1]), {'a': '1'})
+        self.assertEqual(self.store.names(['a']), {'a': 'Torrent A'})
+
+    def test_close_commits_queued_writes(self):
+        self.store.add('a', 1, 'Torrent A')
+        self.store.add('b', 1, 'Torrent B')
+        self.store.remove('b')
+
+        store = self.reopen()
+        self.assertEqual(store.owners(), {'a': '1'})
+        self.assertEqual(store.names(['a', 'b']), {'a': 'Torrent A'})
+
+    def test_adding_for_another_chat_hands_the_torrent_over(self):
+        self.store.add('a', 1, 'Torrent A')
+        self.store.add('a', 2, 'Renamed')
+        self.assertEqual(self.store.owners(), {'a': '2'})
+        self.assertEqual(self.store.names(['a']), {'a': 'Renamed'})
+
+    def test_lookup_of_many_chats(self):
+        self.store.import_chat_torrents({str(chat_id): [f"t{chat_id}"] for chat_id in range(2000)})
+        owners = self.store.owners(range(0, 2000, 2))
+        self.assertEqual(len(owners), 1000)
+        self.assertEqual(owners['t1998'], '1998')
+
+    def test_names_of_many_torrents(self):
+        self.store.import_chat_torrents({'1': {f"t{i}": f"Torrent {i}" for i in range(2000)}, '2': ['u']})
+        names = self.store.names([f"t{i}" for i in range(0, 2000, 2)] + ['u', 'unknown'])
+        self.assertEqual(len(names), 1001)
+        self.assertEqual(names['t1998'], 'Torrent 1998')
+        self.assertIsNone(names['u'])
+
+
+if __name__ == '__main__':
+    unittest.main()